@@ -21,87 +21,159 @@
 
 __all__ = ['Document']
 
-import codecs, json, logging, os, pickle, re
+import codecs, json, logging, os, re, util
 from sys import exit
-from urllib import parse, request
+from urllib import parse
 from collections import OrderedDict
-from math import ceil
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from time import time
-from exceptions import APIError, NoPagesReturned, PickleEmpty
+from attribution import ContributorIndex
+from cache import ResponseCache
+from exceptions import APIError, NoPagesReturned, RequestRejected
+from manifest import Manifest
+from pack import Pack
+from scheduler import Scheduler
+from transport import Transport
+
+def convert(raw_file, text_file):
+    '''Strip the JSON from a single file in /raw, saving the text of its pages, in order, to the
+    matching file in /text. This is kept outside of Document so it can be run in a pool of
+    processes.'''
+    with util.open_file(raw_file) as f:
+        json_data = json.load(f)
+    save_text(text_file, join_pages(json_data["query"]["pages"].values()))
+
+def join_pages(pages):
+    '''Return the text of the pages (as they appear in an API response), ordered by page number.'''
+    return "".join(text for number, text in page_texts(pages))
+
+def page_number(title):
+    '''Return the page number from the title of a page (e.g. 12 for "Page:File.pdf/12").'''
+    return int(title.rsplit("/", 1)[1])
+
+def page_texts(pages):
+    '''Return a list of the page number and text of each of the pages (as they appear in an API
+    response), ordered by page number. Pages the API reports without any text (missing or
+    deleted pages, or hidden revisions) are logged and left out.'''
+    texts = list()
+    for page in sorted(pages, key=lambda page: page_number(page["title"])):
+        revisions = page.get('revisions')
+        if not revisions or "*" not in revisions[0]:
+            logging.getLogger("W2L").warning("No text was returned for {}; skipping it."
+                                             .format(page["title"]))
+            continue
+        texts.append((page_number(page["title"]), revisions[0]["*"]))
+    return texts
+
+def save_text(filename, text):
+    '''Save the text to a file in /text. It is written to a temporary file first and then moved
+    into place, so the file is either complete or missing, never cut short.'''
+    folder, name = os.path.split(filename)
+    temporary = os.path.join(folder, '.' + name) # Keeps the extension, so it's compressed the same
+    try:
+        with util.open_file(temporary, 'w') as file:
+            file.write(text)
+        os.replace(temporary, filename)
+    finally:
+        if os.path.exists(temporary):
+            os.remove(temporary)
 
 class Document(object):
     '''This class reads each page (in the main namespace, not the Index pages) and creates an
     ordered dictionary. The keys in this dictionary are the names of the .djvu files, and the values
     are lists of the page numbers each main page uses.'''
     
-    def __init__(self):
+    def __init__(self, concurrency=8, use_cache=True, api="https://en.wikisource.org/w/api.php",
+                 discovery="chain", compression=None, pack=False):
         # Bare API call, minus the page title
-        self.api_json = "http://en.wikisource.org/w/api.php?format=json&action=query&titles={0}&prop=revisions&rvprop=content"
-        self.api_txt = "http://en.wikisource.org/w/api.php?format=txt&action=query&titles={0}&prop=revisions&rvprop=content"
-        self.api_attribute = "http://en.wikisource.org/w/api.php?format=json&action=query&prop=revisions&titles={0}&rvprop=user&rvlimit=500"
-        self.prefix = parse.quote("United States – Vietnam Relations, 1945–1967: A Study Prepared by the Department of Defense".encode())
+        self.api = api
+        self.api_json = api + "?format=json&action=query&titles={0}&prop=revisions&rvprop=content|ids"
+        self.api_txt = api + "?format=txt&action=query&titles={0}&prop=revisions&rvprop=content|ids"
+        self.api_attribute = api + "?format=json&action=query&prop=info|contributors&titles={0}&pclimit=max"
+        self.api_info = api + "?format=json&action=query&prop=info&titles={0}"
+        self.api_list = api + "?format=json&action=query&list=allpages&apnamespace=0&aplimit=max&apprefix={0}"
+        self.work = "United States – Vietnam Relations, 1945–1967: A Study Prepared by the Department of Defense"
+        self.prefix = parse.quote(self.work.encode())
+        # How to find the main pages: "chain" follows each page's "next" link in turn, "listing"
+        # lists every subpage of the work and downloads them fifty at a time.
+        self.discovery = discovery
+        # Compress new files in /raw and /text with gzip ("gz") or xz ("xz"), or None to store them
+        # as plain text. Existing files are read whichever format they are in.
+        self.compression = compression
         self.pages = OrderedDict()
         self.page_list = []
         self.users = [] # List of any editor who has contributed to any of the Pentagon Papers pages
+        self.anonymous = False # Whether any of the pages have been edited by anonymous users
+        self.contributor_index = ContributorIndex() # Number of edits by each contributor
         self.num_pages = 0
+        self.concurrency = concurrency # Maximum number of API requests in flight at once
+        self.transport = Transport() # Kept-alive connections shared by every API request
+        self.scheduler = Scheduler(self.transport) # Rate limits and retries every API request
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
         
         self.recreated = False # Whether the queries were repeated.
         self.directory = os.curdir
         self.logger = logging.getLogger("W2L")
+        # Responses for pages that haven't been edited since they were last downloaded
+        self.cache = ResponseCache(self.directory + '/cache') if use_cache else None
+        # Main pages, pages, revisions and contributors saved between runs
+        self.manifest = Manifest()
+        # Store the text of the pages in a single pack file, rather than the files in /text
+        self.pack = Pack(self.directory + '/text.pack', self.manifest) if pack else None
         
-    def attribute(self):
-        # TODO: This is slow as all hell (it took me 6 minutes) and will only get worse as more
-        # pages are added. Try to figure out if there's any way to speed it up.
+    def add_main_page(self, title, text):
+        '''Find each pages index tag in the text of a main page and add the page numbers for each
+        to self.pages. Returns the target of the page's "next" link, or "" if it has none.'''
+        # Search for the link to the next page in the document
+        next_r = re.search("\|\snext\s*=\s?[[]{2}(.*?)[]]{2}", text)
         
-        # If the queries haven't been made again and users.txt exists, just use the old list.
-        if not self.recreated and os.path.exists('users.txt'):
+        # Find each pages index tag and collect the page numbers for each
+        pages_r = re.findall("""<pages\sindex="(.*?)"\sfrom=(\d+)\sto=(\d+)\s\/>""", text)
+        if pages_r and title:
+            index = pages_r[0][0]
+            if title not in self.pages:
+                self.pages[title] = [index]
+            for page in pages_r:
+                page1 = int(page[1])
+                page2 = int(page[2])
+                if page1 == page2:
+                    self.pages[title].append(page1)
+                else:
+                    self.pages[title].extend(list(range(page1, page2+1)))
+        return next_r.group(1) if next_r else ""
+    
+    def attribute(self):
+        '''Compile the list of users who have contributed to any of the pages. Contributors are
+        requested for fifty pages at a time, with the batches spread over the same bounded pool of
+        connections that is used to download the content, and counted in a ContributorIndex.'''
+        # If the queries haven't been made again and the list was saved, just use the old list.
+        if not self.recreated and self.manifest.users():
             self.logger.debug("Reading saved list of contributors.")
-            with codecs.open("users.txt", 'r', 'utf-8') as file:
-                users = file.readlines()
-                for user in users:
-                    user = user.rstrip('\n')
-                    self.users.append(user)                    
+            self.contributor_index = ContributorIndex()
+            self.contributor_index.edits.update(self.manifest.users())
+            self.contributor_index.anonymous = self.manifest.anonymous() or 0
         # Can't use the old list because it doesn't exist or new queries were made.
         else:
             self.logger.debug("Getting list of contributors.")
             start_time = time()
             if not self.page_list:
-                if os.path.exists('eachpage.pkl'):
-                    self.logger.debug("Attribution page list found. Unpickling.")
-                    with open('eachpage.pkl', 'rb') as file:
-                        try:
-                            self.page_list = pickle.load(file)
-                            if len(self.page_list) == 0:
-                                raise PickleEmpty()
-                        except PickleEmpty:
-                            self.logger.exception("Pickle file is empty. Delete the eachpage.pkl "
-                                                  "and pagelist.pkl files and try running the "
-                                                  "program again.")
-                            exit()
-                        except Exception as e:
-                            self.logger.exception("Error occurred when trying to unpickle the "
-                                                  "list of pages for attribution: {}"
-                                                  .format(e.strerror))
-                else:
+                self.page_list = self.manifest.titles()
+                if not self.page_list:
                     raise APIError()
-            for page in self.page_list:
-                query = self.api_attribute.format(page)
-                response = json.loads(request.urlopen(query).read().decode('utf-8'))
-                rev_id = list(response["query"]["pages"].keys())[0]
-                user_list = response["query"]["pages"][rev_id]["revisions"]
-                for entry in user_list:
-                    try:
-                        user = entry["user"]
-                    except KeyError:
-                        # This will catch redacted usernames
-                        pass
-                    if user not in self.users:
-                        self.users.append(user)
+            batches = [self.page_list[i:i+50] for i in range(0, len(self.page_list), 50)]
+            self.contributor_index = ContributorIndex()
+            for names, anonymous in self.executor.map(self.contributors, batches):
+                self.contributor_index.add(names, anonymous)
+            if self.cache:
+                self.cache.save()
+            self.manifest.save_users(self.contributor_index)
             with codecs.open("users.txt", 'w', 'utf-8') as file:
-                for user in self.users:
+                for user in self.contributor_index.users():
                     file.write(user + '\n')
             self.logger.debug("List of users compiled in {} seconds."
                               .format(round(time()-start_time, 2)))
+        self.users = self.contributor_index.users()
+        self.anonymous = self.contributor_index.anonymous > 0
         return self.users
             
     def call(self):
@@ -120,9 +192,8 @@ class Document(object):
         |   +-- /2                 <-- folder for the third main page ('/I. Vietnam and the U.S., 1940–1950')
         |   |   +-- 0.txt          <-- text from the first API call (in this case, pages 1-4)
         |   +-- /3                 <-- folder for the fourth main page ('/I. A. U.S. Policy, 1940–50')
-        |   |   +-- 0.txt          <-- text from the first API call (pages 5-9)
-        |   |   +-- 1.txt          <-- text from the second API call (pages 10-59)
-        |   |   +-- 2.txt          <-- text from the third API call (pages 60-73)
+        |   |   +-- 0.txt          <-- text from the first API call (pages 5-54)
+        |   |   +-- 1.txt          <-- text from the second API call (pages 55-73)
         
         ...and so on.
         '''
@@ -136,215 +207,441 @@ class Document(object):
             exit("Cannot create file structure.")
           
         start_time = time()
-        pages_count = 0  
-        # Iterate through each entry in the self.pages dict to perform the API calls
-        for key in self.pages.keys():
-            calls = self.form_call()
+        # Form every API call up front so each one knows which file it belongs in, regardless of
+        # the order in which the responses come back.
+        self.page_list = list()
+        jobs = list()
+        for pages_count, key in enumerate(self.pages.keys()):
             os.mkdir(self.directory + '/raw/' + (str(pages_count)))
-            call_count = 0
-            for call in calls:
-                filename = self.directory + '/raw/' + str(pages_count) + "/" + str(call_count) + ".json"
-                with codecs.open(filename, 'w', 'utf-8') as file:
-                    text = request.urlopen(call).read().decode('utf-8')
-                    file.write(text)
-                call_count += 1
-            pages_count += 1
-        self.logger.debug("Download queries completed in {} seconds."
-                          .format(round(time()-start_time, 2)))
+            if not self.pack:
+                os.makedirs(self.directory + '/text/' + (str(pages_count)), exist_ok=True)
+            for call_count, titles in enumerate(self.form_call(key)):
+                jobs.append((pages_count, call_count, titles))
+        
+        # Perform the API calls, at most self.concurrency at a time. Each response is stored, and
+        # its text extracted, as soon as it arrives.
+        futures = {self.executor.submit(self.fetch, job[2]): job for job in jobs}
+        failed = list()
+        for future in as_completed(futures):
+            folder, number, titles = futures[future]
+            pages = future.result()
+            self.write_raw(self.raw_file(folder, number), pages.values())
+            try:
+                self.write_text(folder, number, pages.values())
+            except Exception:
+                # The response is saved, so finish the download before trying again from /raw
+                self.logger.exception("Unable to store the text of {}/{}; it will be extracted "
+                                      "again from /raw.".format(folder, number))
+                failed.append((folder, number))
+            self.manifest.save_revisions(self.page_revisions(pages))
+        for folder, number in failed:
+            self.write_text(folder, number, self.read_raw(self.raw_file(folder, number)).values())
+        if self.cache:
+            self.cache.save()
+        self.logger.debug("{} download queries completed in {} seconds."
+                          .format(len(jobs), round(time()-start_time, 2)))
+        
+    def continued(self, url):
+        '''Perform an API query, following the API's continuation until it has returned every
+        result. Yields the pages and full response (as returned by query_pages) for each part.'''
+        continuation = ""
+        while True:
+            pages, response = self.query_pages(url + continuation)
+            yield pages, response
+            if "continue" not in response:
+                break
+            continuation = "&" + parse.urlencode(response["continue"])
+    
+    def contributors(self, titles):
+        '''Return a list of the users who have edited each of the given pages (a user appears once
+        for each page they edited) and the number of anonymous editors, following the API's
+        continuation until every contributor has been listed. Pages that haven't been edited since
+        they were last attributed are read from the cache.'''
+        results, missing = self.from_cache('contributors', titles)
+        if missing:
+            for key, entry in self.split_batch(self.query_contributors, missing).items():
+                results[key] = entry
+                if self.cache and entry["revid"]:
+                    self.cache.put('contributors', key, entry["revid"], json.dumps(entry))
+        users = list()
+        anonymous = 0
+        for title in titles:
+            entry = results.get(self.normalize(title))
+            if entry:
+                users.extend(entry["names"])
+                anonymous += entry["anon"]
+        return users, anonymous
+        
+    def discover(self):
+        '''Find the main pages by listing every subpage of the work, rather than following the
+        "next" links from one page to the next. The subpages are downloaded fifty at a time, and
+        the order of the main pages is then rebuilt from their "next" links without any further
+        requests.'''
+        start_time = time()
+        titles = list()
+        for pages, response in self.continued(self.api_list.format(parse.quote(self.work + "/"))):
+            titles.extend(parse.quote(entry["title"]) for entry in response["query"]["allpages"])
+        
+        texts = dict()
+        groups = [titles[i:i+50] for i in range(0, len(titles), 50)]
+        for pages in self.executor.map(self.fetch, groups):
+            texts.update((key, page["revisions"][0]["*"]) for key, page in pages.items()
+                         if "revisions" in page)
+        self.logger.debug("{} subpages downloaded in {} seconds."
+                          .format(len(texts), round(time()-start_time, 2)))
         
-    def form_call(self):
-        '''Form the URLs to pull data from the API. The API supports calls of up to fifty pages
-        at a time; if necessary, this will create multiple URLs in case the list of pages is too
-        long. Returns a list containing one or more URLs, each of which requests the content of
-        1-50 pages.'''
+        # Follow the "next" links through the downloaded pages
+        current = self.work + "/Front matter"
+        seen = set()
+        while current and current not in seen:
+            seen.add(current)
+            if current not in texts:
+                # The link leads outside the listing, so request that page on its own
+                for key, page in self.fetch([parse.quote(current)]).items():
+                    if "revisions" in page:
+                        texts[key] = page["revisions"][0]["*"]
+                if current not in texts:
+                    self.logger.warning("Main page {} could not be found.".format(current))
+                    break
+            next_link = self.add_main_page(current, texts[current])
+            if next_link.startswith("/"):
+                next_link = self.work + next_link
+            current = self.normalize(next_link)
         
-        current_page = self.pages.popitem(False)
-        self.logger.debug("Requesting content for {}".format(current_page[0]))
-        filename = parse.quote(current_page[1].pop(0))
-        pages = self.split_calls(current_page[1])
+    def download(self, url):
+        '''Perform a single API call and return the decoded response.'''
+        return self.scheduler.get(url)
+    
+    def fetch(self, titles, revisions=None):
+        '''Download the content of a batch of pages, reading any that haven't been edited since
+        they were last downloaded from the cache. Returns a dictionary of the pages, keyed by
+        normalized title.'''
+        pages, missing = self.from_cache('content', titles, revisions)
+        if missing:
+            fetched = self.query_batch(self.api_json, missing)
+            for key, page in fetched.items():
+                pages[key] = page
+                if self.cache and "revisions" in page:
+                    self.cache.put('content', key, page["revisions"][0]["revid"], json.dumps(page))
+        return pages
+        
+    def form_call(self, title):
+        '''Form the calls to pull data from the API for the main page with the given title. The API
+        supports calls of up to fifty pages at a time; if necessary, this will create multiple calls
+        in case the list of pages is too long. Returns a list containing one or more calls, each of
+        which is a list of the titles of 1-50 pages.'''
+        
+        self.logger.debug("Requesting content for {}".format(title))
+        filename = parse.quote(self.pages[title][0])
+        pages = self.split_calls(self.pages[title][1:])
 
-        titles = ""
+        position = list(self.pages.keys()).index(title)
         api_calls = list()
-        for group in pages:
-            for number in group:
-                self.page_list.append("Page:" + filename + "/" + str(number))
-                titles += "Page:" + filename + "/" + str(number) + "|"
-            titles = titles[:-1]
-            api_calls.append(self.api_json.format(titles))
-            titles = ""
-        with open('eachpage.pkl', 'wb') as file:
-            try:
-                pickle.dump(self.page_list, file)
-            except Exception as e:
-                self.logger.exception("Exception occurred when trying to pickle the attribution "
-                                      "page list: {}".format(e.strerror))
+        for batch, group in enumerate(pages):
+            titles = ["Page:" + filename + "/" + str(number) for number in group]
+            self.page_list.extend(titles)
+            self.manifest.add_titles(position, batch, titles,
+                                     [self.normalize(title) for title in titles])
+            api_calls.append(titles)
         return api_calls
     
+    def from_cache(self, kind, titles, revisions=None):
+        '''Split a batch of titles into the responses that can be read from the cache, keyed by
+        their normalized titles, and a list of the titles that have to be requested from the API.
+        Unless they are given, revision IDs are only looked up for the pages that have something
+        cached.'''
+        found = dict()
+        if not self.cache:
+            return found, list(titles)
+        if revisions is None:
+            cached = [title for title in titles
+                      if self.cache.revision(kind, self.normalize(title)) is not None]
+            revisions = self.revisions(cached) if cached else dict()
+        missing = list()
+        for title in titles:
+            key = self.normalize(title)
+            payload = self.cache.get(kind, key, revisions.get(key))
+            if payload is None:
+                missing.append(title)
+            else:
+                found[key] = json.loads(payload)
+        return found, missing
+    
     def json_to_text(self):
-        os.mkdir(os.curdir + '/text')
-        folders = sorted(os.listdir(path=(os.curdir + '/raw')), key=int)
-        for folder in folders:
-            os.mkdir(os.curdir + '/text/' + folder)
-            files = sorted(os.listdir(path=(os.curdir + '/raw/' + folder)), key=lambda x: int(x[0]))
-            for file in files:
-                with open(os.curdir + '/raw/' + folder + '/' + file, 'r') as f:
-                    data = f.read()
-                    json_data = json.loads(data)
-                    pagedict = dict()
-                    for key in json_data["query"]["pages"].keys():
-                        pagedict[json_data["query"]["pages"][key]["title"]] = key
-                    pagelist = sorted(pagedict.keys())
-                    with codecs.open(os.curdir + '/text/' + folder + '/' + file[0] +'.txt', 'w', 'utf-8') as textfile:
-                        for pagename in pagelist:
-                            textfile.write(json_data["query"]["pages"][pagedict[pagename]]['revisions'][0]["*"])
-                            
-        
+        '''Strip the JSON from each file in /raw whose text hasn't been extracted, saving the text
+        to /text (or the pack). This is only needed when rebuilding the text, or when a run stopped
+        before all of it was stored, as call extracts it while downloading; the files are
+        converted in parallel by a pool of processes.'''
+        jobs = list()
+        for folder, number, raw_file in self.missing_text():
+            if self.pack:
+                # The pack has a single writer, so the files are read one at a time
+                pages = self.read_raw(raw_file)
+                self.pack.append(folder, number, page_texts(pages.values()))
+                continue
+            os.makedirs(self.directory + '/text/' + str(folder), exist_ok=True)
+            jobs.append((raw_file, self.text_file(folder, number)))
+        if not jobs:
+            return
+        with ProcessPoolExecutor() as executor:
+            for result in executor.map(convert, *zip(*jobs), chunksize=8):
+                pass
+    
+    def main_page(self, title):
+        '''Return the API response (in txt format) for the main page with the given title, reading
+        it from the cache if the page hasn't been edited since it was last downloaded.'''
+        found, missing = self.from_cache('main', [title])
+        if not missing:
+            return found[self.normalize(title)]
+        text = self.download(self.api_txt.format(title))
+        revid = re.search(r"\[revid\]\s=>\s(\d+)", text)
+        if self.cache and revid:
+            self.cache.put('main', self.normalize(title), int(revid.group(1)), json.dumps(text))
+        return text
+    
+    def missing_text(self):
+        '''Return the main page (folder), batch number and filename of each file in /raw whose text
+        isn't in /text (or the pack), in order.'''
+        missing = list()
+        if not os.path.exists(self.directory + '/raw'):
+            return missing
+        for folder in sorted(os.listdir(path=(self.directory + '/raw')), key=int):
+            stored = set(self.pack.batches(int(folder))) if self.pack else None
+            for file in sorted(os.listdir(path=(self.directory + '/raw/' + folder)),
+                               key=lambda x: int(x.split('.')[0])):
+                number = int(file.split('.')[0])
+                if self.pack:
+                    found = number in stored
+                else:
+                    found = os.path.exists(self.text_file(folder, number))
+                if not found:
+                    missing.append((int(folder), number,
+                                    self.directory + '/raw/' + folder + '/' + file))
+        return missing
+    
+    def normalize(self, title):
+        '''Return the title as the API reports it, so that titles can be matched with responses.'''
+        return parse.unquote(title).replace("_", " ")
+    
     def organize(self):
         '''Creates the ordered dictionary containing the filenames and page numbers. If possible,
-        it uses a pickled version of this pagelist from a previous run to avoid querying the API
-        repeatedly. This is mostly for debugging and will probably be removed in the release.'''
-        if not os.path.exists('pagelist.pkl'):
-            self.logger.debug("No pickled page list found. Querying API.")
-            current_url = "/Front matter".encode()
-            while current_url != "":
-                current_url = parse.quote(current_url)
-                
-                # Account for relative links
-                if current_url[0] == "/":
-                    current_url = self.prefix + current_url
-
-                # Create API request    
-                current_url = self.api_txt.format(current_url)
-
-                # Get the text of the request
-                current_page = request.urlopen(current_url).read().decode('utf-8')
-                
-                # Search for the link to the next page in the document
-                next_r = re.search("\|\snext\s*=\s?[[]{2}(.*?)[]]{2}", current_page)
-                if next_r:
-                    next_url = next_r.group(1).encode()
-                else:
-                    next_url = ""
+        it uses the page list saved in the manifest from a previous run to avoid querying the API
+        repeatedly.'''
+        if not self.manifest.has_pages():
+            self.logger.debug("No saved page list found. Querying API.")
+            if self.discovery == "listing":
+                self.discover()
+            else:
+                current_url = "/Front matter".encode()
+                while current_url != "":
+                    current_url = parse.quote(current_url)
                     
-                # Get the nicely-formatted page title    
-                title_r = re.search("\[title\]\s=>\s(.*?)\n", current_page)
-                if title_r:
-                    title = title_r.group(1)     
+                    # Account for relative links
+                    if current_url[0] == "/":
+                        current_url = self.prefix + current_url
+    
+                    # Get the text of the request
+                    current_page = self.main_page(current_url)
+                        
+                    # Get the nicely-formatted page title    
+                    title_r = re.search("\[title\]\s=>\s(.*?)\n", current_page)
+                    title = title_r.group(1) if title_r else None
                     
-                # Find each pages index tag and collect the page numbers for each
-                pages_r = re.findall("""<pages\sindex="(.*?)"\sfrom=(\d+)\sto=(\d+)\s\/>""",
-                                     current_page)
-                if pages_r and title:
-                    index = pages_r[0][0]
-                    if title not in self.pages:
-                        self.pages[title] = [index]
-                    for page in pages_r:
-                        page1 = int(page[1])
-                        page2 = int(page[2])
-                        if page1 == page2:
-                            self.pages[title].append(page1)
-                        else:
-                            self.pages[title].extend(list(range(page1, page2+1)))
-                
-                title = None
-                current_url = next_url
-                
+                    # Collect the page numbers, and find the link to the next page in the document
+                    current_url = self.add_main_page(title, current_page).encode()
                 
             if len(self.pages) == 0:
                 raise NoPagesReturned()
                 exit()
+            if self.cache:
+                self.cache.save()
                 
-            # Saves to a text file to avoid having to query the API many times
-            with open('pagelist.pkl', 'wb') as file:
-                try:
-                    pickle.dump(self.pages, file)
-                except Exception as e:
-                    self.logger.exception("Exception occurred when trying to pickle the page list:"
-                                          "{}".format(e.strerror))
-            
+            # Saves the page list to avoid having to query the API many times
+            self.manifest.save_pages(self.pages)
         else:
-            self.logger.debug("Page list found. Unpickling.")
-            with open('pagelist.pkl', 'rb') as file:
-                try:
-                    self.pages = pickle.load(file)
-                    if len(self.pages) == 0:
-                        raise PickleEmpty()
-                except PickleEmpty:
-                    self.logger.exception("Pickle file is empty. Delete the pagelist.pkl file and"
-                                          "try running the program again.")
-                    exit()
-                except Exception as e:
-                    self.logger.exception("Error occurred when trying to unpickle the page list: {}"
-                           .format(e.strerror))
+            self.logger.debug("Saved page list found.")
+            self.pages = self.manifest.load_pages()
             
         self.logger.debug("{} main pages organized.".format(len(self.pages)))
         for page in list(self.pages.items()):
             self.num_pages += len(page[1]) - 1
         
-    def split_calls(self,pagelist):
-        '''The API only accepts 50 calls at a time, so this function splits the lists of pages
-        into groups of 50 or fewer. Because the API sorts results alphabetically, this
-        function also splits page numbers <10 or >99 into separate groups to preserve order.
+    def page_revisions(self, pages):
+        '''Return a dictionary mapping the normalized title of each of the given pages (as returned
+        by fetch) to the ID of the revision that was downloaded.'''
+        return {key: page["revisions"][0]["revid"] for key, page in pages.items() if "revisions" in page}
+    
+    def query_batch(self, api_call, titles):
+        '''Query the API for a batch of titles, returning the pages as query_pages does. A batch
+        the API rejects is split up, as split_batch describes.'''
+        return self.split_batch(lambda batch: self.query_pages(api_call.format("|".join(batch)))[0],
+                                titles)
+    
+    def query_contributors(self, titles):
+        '''Request the contributors to a batch of pages, following the API's continuation until
+        every contributor has been listed. Returns a dictionary of the latest revision ID, the
+        names of the users and the number of anonymous editors of each page, keyed by normalized
+        title.'''
+        fetched = dict()
+        for pages, response in self.continued(self.api_attribute.format("|".join(titles))):
+            for key, page in pages.items():
+                entry = fetched.setdefault(key, {"revid": None, "names": [], "anon": 0})
+                entry["revid"] = entry["revid"] or page.get("lastrevid")
+                entry["names"].extend(c["name"] for c in page.get("contributors", []))
+                entry["anon"] += page.get("anoncontributors", 0)
+        return fetched
+    
+    def query_pages(self, url):
+        '''Perform an API query and return a dictionary of the pages in the response, keyed by the
+        normalized title each one was requested as, along with the full response.'''
+        response = json.loads(self.download(url))
+        if "error" in response:
+            error = response["error"]
+            raise RequestRejected("{} returned API error {}: {}"
+                                  .format(url, error.get("code"), error.get("info")))
+        query = response.get("query", dict())
+        requested = {entry["to"]: entry["from"] for entry in query.get("normalized", [])}
+        pages = dict()
+        for page in query.get("pages", dict()).values():
+            pages[self.normalize(requested.get(page["title"], page["title"]))] = page
+        return pages, response
+    
+    def raw_file(self, folder, number):
+        '''Return the name of the file in /raw holding the given API call for the given main page.'''
+        return self.stored_file('/raw/' + str(folder) + '/' + str(number) + '.json')
+    
+    def read_raw(self, filename):
+        '''Return a dictionary of the pages stored in a file in /raw, keyed by normalized title.'''
+        with util.open_file(filename) as file:
+            json_data = json.load(file)
+        return {self.normalize(page["title"]): page for page in json_data["query"]["pages"].values()}
+    
+    def revisions(self, titles):
+        '''Return a dictionary mapping the normalized title of each of the given pages to the ID of
+        its latest revision (or None, if the page doesn't exist).'''
+        revisions = dict()
+        for i in range(0, len(titles), 50):
+            pages = self.query_batch(self.api_info, titles[i:i+50])
+            for key, page in pages.items():
+                revisions[key] = page.get("lastrevid")
+        return revisions
         
-        Returns a list of lists of page numbers. Each list of page numbers contains fewer than
-        50 pages, and page numbers <10 or >99 get their own list.'''
-        splitlist = list()
-        low_index, high_index = None, None
-
-        # Find the index of the first number >=10
-        for idx,page in enumerate(pagelist):
-            if int(page) >= 10:
-                low_index = idx
-                break
-            
-        # Find the index of the first number >=100
-        for idx,page in enumerate(pagelist):
-            if int(page) >= 100:
-                high_index = idx
-                break
+    def split_batch(self, query, titles):
+        '''Run a query (a function of a list of titles that returns a dictionary of pages) on a
+        batch of titles. If the API rejects the request in a way the titles could have caused,
+        the batch is split in half and each half is queried separately, so that one bad title
+        can't fail the whole batch. Any other failure, such as the server still failing after
+        every retry, is raised at once, as splitting the batch would only repeat it.'''
+        try:
+            return query(titles)
+        except RequestRejected:
+            if len(titles) == 1:
+                raise
+            self.logger.warning("Request for {} pages was rejected; splitting it in two."
+                                .format(len(titles)))
+            half = len(titles)//2
+            pages = self.split_batch(query, titles[:half])
+            pages.update(self.split_batch(query, titles[half:]))
+            return pages
+    
+    def split_calls(self, pagelist):
+        '''The API only accepts 50 calls at a time, so this function splits the list of pages into
+        groups of 50 (the last group may be smaller). The API returns the pages sorted by title
+        rather than by page number, so convert puts them back in order.
         
-        # Split page numbers <10   
-        if low_index == None:
-            splitlist.append(pagelist)
-            return splitlist # The list has no page numbers >=10
-        elif low_index > 0:
-            splitlist.append(pagelist[:low_index])
-            
-        # Split page numbers that are >=10 and <100
-        if high_index == None:
-            top = len(pagelist)
-        else:
-            top = high_index
-            
-        number = top-low_index # Number of items in the list containing numbers 10-99
-        list_count = ceil(number/50) # Number of sublists needed for this
-        first_index = low_index # First index to include in the next list
-        for i in range(list_count):
-            sublist = list()
-            if i == list_count-1:
-                page_range = top - first_index
-            else:
-                page_range = 50
-            for j in range(page_range):
-                sublist.append(pagelist[first_index+j])
-            first_index = first_index + page_range # Update first_index with new index
-            splitlist.append(sublist)
-            del sublist
+        Returns a list of lists of page numbers.'''
+        return [pagelist[i:i+50] for i in range(0, len(pagelist), 50)]
+    
+    def stored_file(self, name):
+        '''Return the full name of a file in /raw or /text. If the file already exists (compressed
+        or not) that file is returned, so it is replaced rather than duplicated; otherwise the name
+        has the extension of self.compression.'''
+        filename = self.directory + name
+        for extension in [''] + ['.' + ext for ext in util.compressors]:
+            if os.path.exists(filename + extension):
+                return filename + extension
+        return filename + ('.' + self.compression if self.compression else '')
+    
+    def sync(self):
+        '''Bring an existing /raw (and /text) up to date without downloading everything again. The
+        latest revision IDs of every page are requested in batches and compared with the revisions
+        recorded when the content was last downloaded; only the pages that have been edited since
+        are downloaded again, and only the files containing them are rewritten.'''
+        self.recreated = True
+        start_time = time()
+        known = self.manifest.revisions()
         
-        # Split page numbers that are >=100        
-        if high_index != None:
-            number = len(pagelist) - high_index # Number of items containing numbers >=100
-            list_count = ceil(number/50) # Number of sublists needed for this
-            for i in range(list_count):
-                sublist = list()
-                if i == list_count-1:
-                    page_range = len(pagelist) - first_index
-                else:
-                    page_range = 50
-                for j in range(page_range):
-                    sublist.append(pagelist[first_index+j])
-                first_index = first_index + page_range
-                splitlist.append(sublist)
-                del sublist
-                
-        return splitlist
\ No newline at end of file
+        # Work out which file each page belongs in
+        self.page_list = list()
+        batches = list()
+        for pages_count, key in enumerate(self.pages.keys()):
+            for call_count, titles in enumerate(self.form_call(key)):
+                batches.append((pages_count, call_count, titles))
+        
+        # Get the latest revision of every page
+        latest = dict()
+        groups = [self.page_list[i:i+50] for i in range(0, len(self.page_list), 50)]
+        for revisions in self.executor.map(self.revisions, groups):
+            latest.update(revisions)
+        changed = set(key for key, revid in latest.items() if known.get(key) != revid)
+        
+        # Find the files that need to be rewritten, and any pages they need that can't be taken
+        # from the existing files
+        stale = list()
+        needed = list()
+        for folder, number, titles in batches:
+            filename = self.raw_file(folder, number)
+            keys = [self.normalize(title) for title in titles]
+            existing = self.read_raw(filename) if os.path.exists(filename) else dict()
+            if changed.intersection(keys) or set(existing.keys()) != set(keys):
+                stale.append((folder, number, titles))
+                needed.extend(title for title, key in zip(titles, keys)
+                              if key in changed or key not in existing)
+        self.logger.debug("{} of {} pages have changed; {} files to update."
+                          .format(len(changed), len(latest), len(stale)))
+        
+        # Download the pages that are needed, then rewrite the stale files
+        fetched = dict()
+        groups = [needed[i:i+50] for i in range(0, len(needed), 50)]
+        for pages in self.executor.map(self.fetch, groups, [latest]*len(groups)):
+            fetched.update(pages)
+        for folder, number, titles in stale:
+            filename = self.raw_file(folder, number)
+            existing = self.read_raw(filename) if os.path.exists(filename) else dict()
+            pages = list()
+            for title in titles:
+                key = self.normalize(title)
+                pages.append(fetched[key] if key in fetched else existing[key])
+            # The text is stored first, so if that fails the file in /raw is still stale, and is
+            # rewritten by the next sync
+            if self.pack and self.pack.exists():
+                self.write_text(folder, number, pages)
+            elif not self.pack and os.path.exists(self.directory + '/text'):
+                os.makedirs(self.directory + '/text/' + str(folder), exist_ok=True)
+                self.write_text(folder, number, pages)
+            os.makedirs(self.directory + '/raw/' + str(folder), exist_ok=True)
+            self.write_raw(filename, pages)
+        
+        self.manifest.save_revisions(self.page_revisions(fetched))
+        if self.cache:
+            self.cache.save()
+        self.logger.debug("Sync completed in {} seconds.".format(round(time()-start_time, 2)))
+        
+    def text_file(self, folder, number):
+        '''Return the name of the file in /text holding the given API call for the given main page.'''
+        return self.stored_file('/text/' + str(folder) + '/' + str(number) + '.txt')
+        
+    def write_raw(self, filename, pages):
+        '''Store a batch of pages in /raw, in the same format as the API's responses.'''
+        pages = {str(page.get("pageid", -(i+1))): page for i, page in enumerate(pages)}
+        with util.open_file(filename, 'w') as file:
+            json.dump({"query": {"pages": pages}}, file, ensure_ascii=False)
+    
+    def write_text(self, folder, number, pages):
+        '''Store the text of a batch of pages in /text, or append it to the pack. A file in /text is
+        never left half-written, and a batch is only recorded in the pack once all of it has been
+        appended, so if this fails the batch is missing (see missing_text) rather than cut short.'''
+        if self.pack:
+            self.pack.append(int(folder), int(number), page_texts(pages))
+            return
+        save_text(self.text_file(folder, number), join_pages(pages))
\ No newline at end of file
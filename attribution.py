@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013–2015Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+__all__ = ['ContributorIndex']
+
+import ipaddress
+from collections import Counter
+
+class ContributorIndex(object):
+    '''Counts the edits of everyone who has contributed to the document. Named users are counted in
+    a dictionary, so adding a contributor takes the same time however many are already known.
+    Editors who are only known by their IP address (IPv4 or IPv6) are counted together as
+    anonymous, along with the anonymous edits the API reports as a bare number.'''
+
+    def __init__(self):
+        self.edits = Counter() # Number of edits by each named user
+        self.anonymous = 0 # Number of edits by anonymous users
+
+    def add(self, names, anonymous=0):
+        '''Count an edit by each of the named users, and the given number of anonymous edits.'''
+        for name in names:
+            if self.is_ip(name):
+                self.anonymous += 1
+            else:
+                self.edits[name] += 1
+        self.anonymous += anonymous
+
+    def credits(self):
+        '''Return the list of names to credit: every named user, followed by "anonymous users" if
+        there were any anonymous edits.'''
+        return self.users() + (["anonymous users"] if self.anonymous else [])
+
+    def is_ip(self, name):
+        '''Return whether the name is an IP address rather than a username.'''
+        try:
+            ipaddress.ip_address(name)
+        except ValueError:
+            return False
+        return True
+
+    def users(self):
+        '''Return the named users in alphabetical order, ignoring case. The order doesn't depend on
+        the order the users were added in, so the list is the same on every run.'''
+        return sorted(self.edits.keys(), key=lambda name: (name.casefold(), name))
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013–2015Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''Measures how fast the Tokenizer lexes, so that a change to one of its rules can be checked for
+slowdowns. Each fixture is a sample of one kind of wikitext, repeated to the requested size; the
+results give the tokens and megabytes (of UTF-8) lexed per second for each fixture, and for each
+lexer state within it. The fuzz mode lexes randomly generated pages full of unbalanced templates
+and reports the latency per page, including the worst cases. The pool check cuts a mix of the
+fixtures and fuzzed pages into files at random places (so that tables of contents and templates
+carry on from one file into the next), and checks that tokenizing them in a pool of processes
+gives the same tokens and LaTeX as tokenizing them in order. Results are written as JSON:
+
+    python benchmark.py --repeat 5 --output before.json
+    python benchmark.py --repeat 5 --baseline before.json --tolerance 0.1
+    python benchmark.py --fixtures --fuzz 500 --seed 2
+    python benchmark.py --fixtures --check-pool 4
+
+With --baseline, any fixture whose tokens per second fell by more than the tolerance (or a fuzz
+run whose worst page got that much slower) is reported, and the exit status is 1, as it is if the
+pool check finds any difference.
+'''
+
+__all__ = ['FIXTURES', 'check_pool', 'fixture', 'fuzz', 'measure', 'state_profile',
+           'unbalanced_page']
+
+import argparse, codecs, json, logging, os, platform, random, sys, tempfile, time, util
+from collections import OrderedDict, deque
+from tokenizer import Tokenizer, tokenize_files
+from tokenparser import Parser
+
+FIXTURES = OrderedDict([
+    ('prose', "The United States' policy in 1954 was, as noted above, ''cautious'' and '''firm''';"
+              " see [[w:Geneva Conference|Geneva]]. By 1956 the Government of Vietnam had 150,000"
+              " men under arms... and the reports (some 40 of them) were \"encouraging\".\n\n"),
+    ('running_headers', '<noinclude><pagequality level="4" user="GorillaWarfare" />'
+                        '{{rh|center=IV. C. 2.|right=17}}</noinclude>\nContinued text.\n'),
+    ('toc', "{|\n|A.||The Geneva Accords||1\n|-\n|B.||The Struggle for Power"
+            " <noinclude>|}</noinclude> in the South||12\n|C.||Conclusions||27\n|}\n"),
+    ('wikitable', '{| style="width:50%; text-align:center;" border="1" cellpadding="2"\n|-\n'
+                  '| Fiscal Year || Amount\n|-\n|colspan="2"| style="x"|Total in millions'
+                  ' [[File:Chart.png|thumb]] of dollars\n|-\n| 1955 || 322.4\n|}\n'),
+    ('centered', "{{c|{{x-larger|UNITED STATES – VIETNAM RELATIONS}}}}\n"
+                 "{{center|Prepared by the {{u|Department}} of Defense {{right|1967}}}}\n"
+                 "{{c|'''Book 3''' of {{smaller|12}}}}\n"),
+    ])
+
+# Pieces the fuzz mode builds its pages from
+OPENERS = ['{{rh|', '{{c|', '{{center|', '{{block center|', '{{left|', '{{right|',
+           '{{block right|', '{{hi|2em|', '{{x-larger|', '{{smaller|', '{{u|', '{{gap|', '{{nop']
+STRAYS = ['}}', '}', '{', '{|', '|}', '|-', '||', '|', '[[', ']]', '<ref>', '</ref>',
+          '<noinclude>', "'''", "''", '\n', ':']
+WORDS = ['the', 'policy', 'Vietnam', 'Geneva', '1954', 'of', 'and', 'forces', 'South', 'was',
+         'Diem', 'report', '(a)', 'U.S.', 'aid;', 'said,', 'page']
+
+def check_pool(processes, files, seed):
+    '''Cut the fixtures and some unbalanced pages into the given number of files, and return
+    whether tokenizing them in a pool of processes gives the same tokens and LaTeX, file by file,
+    as tokenizing them one after another with a single Tokenizer (as core.py does with and without
+    --jobs).'''
+    rand = random.Random(seed)
+    pieces = [sample * 3 for sample in FIXTURES.values()]
+    pieces += [unbalanced_page(random.Random(seed + page), 500) for page in range(files)]
+    rand.shuffle(pieces)
+    text = "".join(pieces)
+    cuts = sorted(rand.sample(range(1, len(text)), files - 1))
+    texts = [text[start:end] for start, end in zip([0] + cuts, cuts + [len(text)])]
+    
+    def parse(streams):
+        # The parser seeks back over what it has written, so it needs a real file, as in core.py
+        parser = Parser(util.ProgressChecker())
+        results = list()
+        with tempfile.TemporaryDirectory() as folder:
+            for number, tokens in enumerate(streams):
+                filename = os.path.join(folder, str(number) + '.tex')
+                with codecs.open(filename, 'w+', 'utf-8') as outputfile:
+                    parser.begin(outputfile)
+                    parser.dispatch(tokens)
+                    deque(tokens, maxlen=0)
+                with codecs.open(filename, 'r', 'utf-8') as outputfile:
+                    results.append(outputfile.read())
+        return results
+    
+    def record(streams):
+        for tokens in streams:
+            tokens = list(tokens)
+            lexed.append([(token.code, token.start, token.end, token.value) for token in tokens])
+            yield tokens
+    
+    tokenizer = Tokenizer()
+    lexed = list()
+    in_order = parse(record(tokenizer.iter_tokens(data) for data in texts))
+    in_order_tokens, lexed = lexed, list()
+    pooled = parse(record(tokenize_files(((None, data) for data in texts), processes)))
+    differing = [number for number in range(files)
+                 if in_order[number] != pooled[number] or
+                    in_order_tokens[number] != lexed[number]]
+    return OrderedDict([('processes', processes), ('files', files), ('seed', seed),
+                        ('identical', not differing), ('differing_files', differing)])
+
+def fixture(name, size):
+    '''Return the named fixture, repeated until it's at least size characters long.'''
+    sample = FIXTURES[name]
+    return sample * (size // len(sample) + 1)
+
+def fuzz(tokenizer, pages, size, seed):
+    '''Lex the given number of unbalanced pages, returning statistics of the time each took. Page
+    i is unbalanced_page(random.Random(seed + i), size), so the worst pages can be regenerated.'''
+    times = list()
+    for page in range(pages):
+        data = unbalanced_page(random.Random(seed + page), size)
+        began = time.perf_counter()
+        tokenizer.analyze(data)
+        times.append((time.perf_counter() - began, page, len(data)))
+    ordered = sorted(seconds for seconds, page, length in times)
+    def percentile(fraction):
+        return ordered[int(fraction * (len(ordered) - 1))]
+    return OrderedDict([('pages', pages), ('size', size), ('seed', seed),
+                        ('total_seconds', sum(ordered)),
+                        ('mean_seconds', sum(ordered) / len(ordered)),
+                        ('p50_seconds', percentile(0.5)),
+                        ('p90_seconds', percentile(0.9)),
+                        ('p99_seconds', percentile(0.99)),
+                        ('max_seconds', ordered[-1]),
+                        ('worst', [OrderedDict([('page', page), ('length', length),
+                                                ('seconds', seconds)])
+                                   for seconds, page, length in sorted(times, reverse=True)[:5]])])
+
+def measure(tokenizer, data, repeat):
+    '''Return the throughput of the tokenizer on the text, taking the fastest of the repeats,
+    along with a breakdown by lexer state.'''
+    best = None
+    for attempt in range(repeat):
+        began = time.perf_counter()
+        count = len(tokenizer.analyze(data))
+        seconds = time.perf_counter() - began
+        if best is None or seconds < best:
+            best = seconds
+    result = rates(count, len(data.encode('utf-8')), best)
+    result['states'] = OrderedDict((state, rates(*counts))
+                                   for state, counts in sorted(state_profile(tokenizer, data).items()))
+    return result
+
+def rates(tokens, size, seconds):
+    return OrderedDict([('tokens', tokens), ('bytes', size), ('seconds', seconds),
+                        ('tokens_per_sec', tokens / seconds if seconds else 0),
+                        ('mb_per_sec', size / seconds / 1e6 if seconds else 0)])
+
+def state_profile(tokenizer, data):
+    '''Lex the text one token at a time, timing each, and return {state: [tokens, bytes,
+    seconds]}. Each token is counted in the state the lexer was in when it started on it. Timing
+    every token slows the lexer down a little, so these figures are for comparing the states with
+    each other rather than with the fixture's own throughput.'''
+    lexer = tokenizer.lexer
+    engine = tokenizer.engine
+    clock = time.perf_counter
+    profile = dict()
+    lexer.input(data)
+    while True:
+        state = lexer.lexstate
+        start = lexer.lexpos
+        began = clock()
+        token = engine.token()
+        seconds = clock() - began
+        counts = profile.setdefault(state, [0, 0, 0.0])
+        counts[2] += seconds
+        if not token:
+            break
+        counts[0] += 1
+        counts[1] += len(data[start:lexer.lexpos].encode('utf-8'))
+    return profile
+
+def regressions(results, baseline, tolerance):
+    '''Return a description of each measurement that got slower than the baseline by more than the
+    tolerance (a fraction).'''
+    found = list()
+    for name, result in results.get('fixtures', {}).items():
+        before = baseline.get('fixtures', {}).get(name)
+        if before and result['tokens_per_sec'] < before['tokens_per_sec'] * (1 - tolerance):
+            found.append("{}: {:.0f} tokens/sec, down from {:.0f}"
+                         .format(name, result['tokens_per_sec'], before['tokens_per_sec']))
+    if 'fuzz' in results and 'fuzz' in baseline:
+        now, before = results['fuzz']['max_seconds'], baseline['fuzz']['max_seconds']
+        if now * (1 - tolerance) > before:
+            found.append("fuzz: worst page took {:.4f}s, up from {:.4f}s".format(now, before))
+    return found
+
+def unbalanced_page(random, size):
+    '''Return a page of about size characters of words mixed with the openings of templates that
+    are mostly never closed, and stray braces, table markup, links and tags.'''
+    parts = list()
+    length = 0
+    while length < size:
+        roll = random.random()
+        if roll < 0.25:
+            part = random.choice(OPENERS)
+        elif roll < 0.4:
+            part = random.choice(STRAYS)
+        else:
+            part = random.choice(WORDS) + ' '
+        parts.append(part)
+        length += len(part)
+    return "".join(parts)
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description="Measure the speed of the tokenizer.")
+    arguments.add_argument('--fixtures', nargs='*', choices=list(FIXTURES), default=list(FIXTURES),
+                           metavar='NAME',
+                           help="Fixtures to measure (default: all of them; give none to skip "
+                           "them): " + ", ".join(FIXTURES) + ".")
+    arguments.add_argument('--size', type=int, default=200000,
+                           help="Number of characters to repeat each fixture to.")
+    arguments.add_argument('--repeat', type=int, default=3,
+                           help="Number of times to lex each fixture; the fastest time is kept.")
+    arguments.add_argument('--fuzz', type=int, default=0, metavar='PAGES',
+                           help="Also lex this many pages of unbalanced templates.")
+    arguments.add_argument('--fuzz-size', type=int, default=3000, metavar='SIZE',
+                           help="Number of characters in each fuzzed page.")
+    arguments.add_argument('--seed', type=int, default=0,
+                           help="Seed for the first fuzzed page.")
+    arguments.add_argument('--check-pool', type=int, default=0, metavar='PROCESSES',
+                           help="Also check that a pool of this many processes tokenizes files "
+                           "just as one process does.")
+    arguments.add_argument('--check-files', type=int, default=40, metavar='FILES',
+                           help="Number of files to cut the text into for the pool check.")
+    arguments.add_argument('--no-prefilter', action='store_true',
+                           help="Lex with PLY's master regexes rather than the Prefilter.")
+    arguments.add_argument('--output', metavar='FILE',
+                           help="Write the results to this file rather than printing them.")
+    arguments.add_argument('--baseline', metavar='FILE',
+                           help="Results of an earlier run to compare with.")
+    arguments.add_argument('--tolerance', type=float, default=0.1,
+                           help="Fraction by which a result may be slower than the baseline.")
+    args = arguments.parse_args()
+
+    logging.getLogger("W2L").addHandler(logging.NullHandler())
+    logging.getLogger("W2L").propagate = False
+    tokenizer = Tokenizer(prefilter=not args.no_prefilter)
+    results = OrderedDict([('python', platform.python_version()),
+                           ('rules', tokenizer.rules_hash()),
+                           ('prefilter', not args.no_prefilter),
+                           ('repeat', args.repeat)])
+    if args.fixtures:
+        results['fixtures'] = OrderedDict((name, measure(tokenizer, fixture(name, args.size),
+                                                         max(1, args.repeat)))
+                                          for name in args.fixtures)
+    if args.fuzz:
+        results['fuzz'] = fuzz(tokenizer, args.fuzz, args.fuzz_size, args.seed)
+    found = list()
+    if args.check_pool:
+        results['pool'] = check_pool(args.check_pool, args.check_files, args.seed)
+        if not results['pool']['identical']:
+            found.append("pool: files {} tokenized differently in a pool"
+                         .format(results['pool']['differing_files']))
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressed = regressions(results, json.load(f), args.tolerance)
+        results['regressions'] = regressed
+        found.extend(regressed)
+    text = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    for regression in found:
+        print("Failed: " + regression, file=sys.stderr)
+    sys.exit(1 if found else 0)
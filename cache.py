@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013–2015Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+__all__ = ['ResponseCache']
+
+import codecs, hashlib, json, logging, os, threading
+
+class ResponseCache(object):
+    '''On-disk cache of API responses. Each response is stored once, named by the SHA-1 hash of its
+    contents, and an index maps the kind of response, the page title, and the page's revision ID to
+    that hash. A cached response is only returned for the revision it was downloaded at, so any
+    page that has been edited since is downloaded again.
+
+    /cache
+    +-- index.json             <-- {"kind|title": [revision ID, hash], ...}
+    +-- /objects
+    |   +-- /3f
+    |   |   +-- 3f786850e387550fdab836ed7e6dc881de23001b
+    ...and so on.
+    '''
+
+    def __init__(self, directory):
+        self.logger = logging.getLogger("W2L")
+        self.directory = directory
+        self.index_file = os.path.join(directory, 'index.json')
+        self.lock = threading.Lock()
+        self.changed = False
+        self.index = dict()
+        if os.path.exists(self.index_file):
+            try:
+                with codecs.open(self.index_file, 'r', 'utf-8') as file:
+                    self.index = json.load(file)
+            except ValueError:
+                self.logger.exception("Cache index is corrupted; starting with an empty cache.")
+
+    def object_path(self, digest):
+        return os.path.join(self.directory, 'objects', digest[:2], digest)
+
+    def revision(self, kind, title):
+        '''Return the revision ID the cached response for this page was downloaded at, or None if
+        nothing is cached for it.'''
+        entry = self.index.get(kind + '|' + title)
+        return entry[0] if entry else None
+
+    def get(self, kind, title, revid):
+        '''Return the cached response for the page at the given revision, or None.'''
+        entry = self.index.get(kind + '|' + title)
+        if not entry or revid is None or entry[0] != revid:
+            return None
+        try:
+            with codecs.open(self.object_path(entry[1]), 'r', 'utf-8') as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def put(self, kind, title, revid, payload):
+        '''Store the response for the page at the given revision.'''
+        digest = hashlib.sha1(payload.encode('utf-8')).hexdigest()
+        path = self.object_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp = path + '.' + str(threading.get_ident())
+            with codecs.open(temp, 'w', 'utf-8') as file:
+                file.write(payload)
+            os.replace(temp, path)
+        with self.lock:
+            self.index[kind + '|' + title] = [revid, digest]
+            self.changed = True
+
+    def save(self):
+        '''Write the index to disk, if anything has been added to it.'''
+        with self.lock:
+            if not self.changed:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            with codecs.open(self.index_file + '.tmp', 'w', 'utf-8') as file:
+                json.dump(self.index, file)
+            os.replace(self.index_file + '.tmp', self.index_file)
+            self.changed = False
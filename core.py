@@ -19,8 +19,10 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import codecs, logging, os, util
-from tokenizer import Tokenizer
+import argparse, codecs, logging, os, util
+from collections import deque
+from tokenizer import Tokenizer, tokenize_files
+from tokentrace import TokenTrace
 from tokenparser import Parser
 from api import Document
 
@@ -35,18 +37,53 @@ def setup_logging():
     return logger
 
 if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description="Parse a Wikisource document into LaTeX.")
+    arguments.add_argument('--api', default="https://en.wikisource.org/w/api.php",
+                           help="URL of the MediaWiki API to query (for example, a local "
+                           "mockserver.py).")
+    arguments.add_argument('--discovery', choices=['chain', 'listing'], default='chain',
+                           help="Find the main pages by following each page's \"next\" link "
+                           "(chain), or by listing every subpage of the work (listing).")
+    arguments.add_argument('--sync', action='store_true',
+                           help="Download only the pages that have been edited since /raw was "
+                           "created.")
+    arguments.add_argument('--compression', choices=['gz', 'xz'],
+                           help="Compress the files in /raw and /text as they are written.")
+    arguments.add_argument('--pack', action='store_true',
+                           help="Store the text of the pages in a single file (text.pack) rather "
+                           "than the files in /text.")
+    arguments.add_argument('--trace', metavar='FILE',
+                           help="Record the tokens produced by the lexer in this file.")
+    arguments.add_argument('--trace-types', nargs='+', metavar='TYPE',
+                           help="Only record tokens of these types.")
+    arguments.add_argument('--trace-files', nargs='+', metavar='PATTERN',
+                           help="Only record tokens from files matching these patterns (such as "
+                           "3/*).")
+    arguments.add_argument('--trace-every', type=int, default=1, metavar='N',
+                           help="Only record one in every N tokens.")
+    arguments.add_argument('--jobs', type=int, default=1, metavar='N',
+                           help="Tokenize the text files in a pool of N processes.")
+    args = arguments.parse_args()
+    
     logger = setup_logging()
-    doc = Document()
+    doc = Document(api=args.api, discovery=args.discovery, compression=args.compression,
+                   pack=args.pack)
     doc.organize()
     if not os.path.exists(os.curdir + '/raw'):
         logger.debug("Getting raw text files.")
         doc.call()
-    if not os.path.exists(os.curdir + '/text'):
+    elif args.sync:
+        logger.debug("Updating raw text files.")
+        doc.sync()
+    if doc.missing_text():
         logger.debug("Parsing JSON to TXT.")
         doc.json_to_text()
     
     # Open and read files
-    tokenizer = Tokenizer()
+    trace = None
+    if args.trace:
+        trace = TokenTrace(args.trace, args.trace_types, args.trace_files, args.trace_every)
+    tokenizer = Tokenizer(trace)
     progress = util.ProgressChecker()
     parser = Parser(progress)
     if not os.path.exists(os.curdir + '/latex'):
@@ -54,24 +91,60 @@ if __name__ == "__main__":
     if not os.path.exists(os.curdir + '/latex'):
         os.mkdir(os.curdir + '/latex')
     #folders = sorted(os.listdir(path=(os.curdir + '/text')), key=int)
-    folders = ['0', '1', '2', '3']
+    if doc.pack:
+        folders = [str(volume) for volume in doc.pack.volumes()]
+    else:
+        folders = ['0', '1', '2', '3']
+    jobs = list() # Each folder, with the files in it to parse
     for folder in folders:
-        files = sorted(os.listdir(path=(os.curdir + '/text/' + folder)), key=lambda x: int(x[0]))
-        if folder == '3':
-            files = ['0.txt', '1.txt']
+        if doc.pack:
+            files = [str(batch) for batch in doc.pack.batches(int(folder))]
+            if folder == '3':
+                files = ['0', '1']
+        else:
+            # Hidden files are the temporary files of writes that didn't finish
+            numbers = sorted(set(int(x.split('.')[0])
+                                 for x in os.listdir(path=(os.curdir + '/text/' + folder))
+                                 if not x.startswith('.')))
+            if folder == '3':
+                numbers = [0, 1]
+            # The names of the files, with the extension of any compression
+            files = [os.path.basename(doc.text_file(folder, number)) for number in numbers]
+        jobs.append((folder, files))
+    
+    def read_text(folder, file):
+        if doc.pack:
+            return doc.pack.read(int(folder), int(file))
+        with util.open_file(os.curdir + '/text/' + folder + '/' + file) as f:
+            return f.read()
+    
+    if args.jobs > 1 and trace:
+        logger.warning("Tokens can't be traced in a pool of processes; tokenizing in this one.")
+    if args.jobs > 1 and not trace:
+        # In the pack the text is read here, otherwise each process reads its own file
+        streams = tokenize_files(((folder + '/' + file, read_text(folder, file)) if doc.pack else
+                                  (os.curdir + '/text/' + folder + '/' + file, None)
+                                  for folder, files in jobs for file in files), args.jobs)
+    else:
+        streams = (tokenizer.iter_tokens(read_text(folder, file), folder + '/' + file)
+                   for folder, files in jobs for file in files)
+    for folder, files in jobs:
         with codecs.open(os.curdir + '/latex/' + folder + '.tex', 'w+', 'utf-8') as outputfile:
             last_open = os.curdir + '/latex/' + folder + '.tex'
             for file in files:
                 logger.debug("Parsing " + folder + "/" + file + " to " + folder + ".tex.")
-                with codecs.open(os.curdir + '/text/' + folder + '/' + file, 'r', 'utf-8') as f:
-                    data = f.read()
-                    token_list = tokenizer.analyze(data)
-                    parser.begin(outputfile)
-                    parser.dispatch(token_list)
+                parser.begin(outputfile)
+                tokens = next(streams)
+                parser.dispatch(tokens)
+                # If the parser gave up on the file, finish lexing it anyway, so the next file
+                # starts in the state this one ends in, with or without a pool
+                deque(tokens, maxlen=0)
+    if trace:
+        trace.close()
     print("Total number of pages included in main pages: " + str(doc.num_pages))
     progress.get_statistics()
 #    with codecs.open(last_open, 'a', 'utf-8') as outputfile:
 #        contributors = doc.attribute()
-#        parser.end_matter(contributors, outputfile)
+#        parser.end_matter(contributors, outputfile, doc.anonymous)
         
     logger.debug("Parsing complete.")
\ No newline at end of file
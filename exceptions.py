@@ -28,10 +28,13 @@ class APIError(W2LError):
 class NoPagesReturned(APIError):
     '''The query to the Wikimedia API returned 0 main pages. The query may have been formatted
     incorrectly.'''
-    
-class PickleEmpty(APIError):
-    '''The pickle file containing the list of pages is empty. Delete the file, then re-run the
-    program.'''
+
+class RequestFailed(APIError):
+    '''An API request failed, and kept failing when it was retried.'''
+
+class RequestRejected(RequestFailed):
+    '''The API refused a request because of what was asked for (an HTTP 400, 413 or 414, or an
+    error in the response), so asking for fewer titles at a time may succeed.'''
 
 class ParseError(W2LError):
     '''There was an error while parsing the document.'''
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013–2015Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+__all__ = ['Manifest']
+
+import logging, sqlite3, threading
+from collections import OrderedDict
+
+class Manifest(object):
+    '''SQLite database holding everything that is known about the document between runs: the main
+    pages and the ranges of pages they include, every page's title, the file it is stored in, the
+    revision it was downloaded at, and the contributors. Every update is a small transaction, so an
+    interrupted run never leaves the manifest half-written.'''
+
+    schema = '''
+        CREATE TABLE IF NOT EXISTS mainpages (
+            position INTEGER PRIMARY KEY,   -- Order of the main page in the document
+            title TEXT UNIQUE NOT NULL,
+            index_file TEXT NOT NULL        -- Name of the .djvu/.pdf file the pages come from
+        );
+        CREATE TABLE IF NOT EXISTS ranges (
+            mainpage INTEGER NOT NULL REFERENCES mainpages(position),
+            first INTEGER NOT NULL,
+            last INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS pages (
+            title TEXT PRIMARY KEY,         -- Title as it is requested from the API
+            name TEXT NOT NULL,             -- Title as the API reports it
+            mainpage INTEGER NOT NULL,
+            batch INTEGER NOT NULL,         -- Number of the file in /raw/<mainpage> holding the page
+            position INTEGER NOT NULL,      -- Position of the page in that file
+            revid INTEGER,                  -- Revision the page was downloaded at
+            status TEXT NOT NULL DEFAULT 'pending'
+        );
+        CREATE INDEX IF NOT EXISTS pages_name ON pages(name);
+        CREATE TABLE IF NOT EXISTS packed (
+            mainpage INTEGER NOT NULL,
+            batch INTEGER NOT NULL,
+            page INTEGER NOT NULL,          -- Page number
+            offset INTEGER NOT NULL,        -- Position of the page's text in the pack, in bytes
+            length INTEGER NOT NULL,
+            PRIMARY KEY (mainpage, batch, page)
+        );
+        CREATE TABLE IF NOT EXISTS contributors (
+            position INTEGER PRIMARY KEY,
+            name TEXT UNIQUE NOT NULL,
+            edits INTEGER NOT NULL DEFAULT 0 -- Number of pages the user has edited
+        );
+        CREATE TABLE IF NOT EXISTS anonymous (
+            edits INTEGER NOT NULL          -- Number of anonymous edits; a single row
+        );
+        '''
+
+    def __init__(self, filename='manifest.db'):
+        self.logger = logging.getLogger("W2L")
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.executescript(self.schema)
+
+    def add_titles(self, mainpage, batch, titles, names):
+        '''Record the pages requested by one API call.'''
+        with self.lock, self.db:
+            self.db.executemany('''INSERT INTO pages (title, name, mainpage, batch, position)
+                                   VALUES (?, ?, ?, ?, ?)
+                                   ON CONFLICT(title) DO UPDATE SET mainpage=excluded.mainpage,
+                                   batch=excluded.batch, position=excluded.position''',
+                                [(title, name, mainpage, batch, position) for position, (title, name)
+                                 in enumerate(zip(titles, names))])
+
+    def anonymous(self):
+        '''Return the number of anonymous edits to the pages, or None if it hasn't been saved.'''
+        with self.lock:
+            row = self.db.execute('SELECT edits FROM anonymous').fetchone()
+        return row[0] if row else None
+
+    def has_pages(self):
+        '''Return whether the main pages have been saved.'''
+        with self.lock:
+            return self.db.execute('SELECT 1 FROM mainpages LIMIT 1').fetchone() is not None
+
+    def load_pages(self):
+        '''Return the ordered dictionary of main pages, in the same form as Document.pages: each
+        title maps to a list containing the index file, followed by the page numbers.'''
+        pages = OrderedDict()
+        with self.lock:
+            rows = self.db.execute('''SELECT m.title, m.index_file, r.first, r.last
+                                      FROM mainpages m LEFT JOIN ranges r ON r.mainpage = m.position
+                                      ORDER BY m.position, r.rowid''').fetchall()
+        for title, index_file, first, last in rows:
+            if title not in pages:
+                pages[title] = [index_file]
+            if first is not None:
+                pages[title].extend(range(first, last+1))
+        return pages
+
+    def packed(self):
+        '''Return the index of the pack: each (main page, batch) maps to a list of the offset and
+        length of each of its pages, in page order.'''
+        index = OrderedDict()
+        with self.lock:
+            rows = self.db.execute('''SELECT mainpage, batch, offset, length FROM packed
+                                      ORDER BY mainpage, batch, page''').fetchall()
+        for mainpage, batch, offset, length in rows:
+            index.setdefault((mainpage, batch), []).append((offset, length))
+        return index
+
+    def revisions(self):
+        '''Return the revision IDs of the pages that have been downloaded, keyed by the titles the
+        API reports.'''
+        with self.lock:
+            return dict(self.db.execute('SELECT name, revid FROM pages WHERE revid IS NOT NULL'))
+
+    def save_pages(self, pages):
+        '''Replace the main pages with those in the ordered dictionary (in the same form as
+        Document.pages). Consecutive page numbers are stored as ranges.'''
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM ranges')
+            self.db.execute('DELETE FROM mainpages')
+            for position, (title, entry) in enumerate(pages.items()):
+                self.db.execute('INSERT INTO mainpages VALUES (?, ?, ?)',
+                                (position, title, entry[0]))
+                ranges = list()
+                for number in entry[1:]:
+                    if ranges and number == ranges[-1][1] + 1:
+                        ranges[-1][1] = number
+                    else:
+                        ranges.append([number, number])
+                self.db.executemany('INSERT INTO ranges VALUES (?, ?, ?)',
+                                    [(position, first, last) for first, last in ranges])
+
+    def save_packed(self, mainpage, batch, entries):
+        '''Replace the index entries for a batch in the pack with the given list of (page number,
+        offset, length).'''
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM packed WHERE mainpage = ? AND batch = ?', (mainpage, batch))
+            self.db.executemany('INSERT INTO packed VALUES (?, ?, ?, ?, ?)',
+                                [(mainpage, batch, page, offset, length)
+                                 for page, offset, length in entries])
+
+    def save_revisions(self, revisions):
+        '''Record the revisions that pages were downloaded at, keyed by the titles the API
+        reports.'''
+        with self.lock, self.db:
+            self.db.executemany('''UPDATE pages SET revid = ?, status = 'fetched'
+                                   WHERE name = ?''',
+                                [(revid, name) for name, revid in revisions.items()])
+
+    def save_users(self, index):
+        '''Replace the list of contributors with those in a ContributorIndex.'''
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM contributors')
+            self.db.execute('DELETE FROM anonymous')
+            self.db.executemany('INSERT INTO contributors (name, edits) VALUES (?, ?)',
+                                [(user, index.edits[user]) for user in index.users()])
+            self.db.execute('INSERT INTO anonymous VALUES (?)', (index.anonymous,))
+
+    def titles(self):
+        '''Return the title of every page, in the order they appear in the document.'''
+        with self.lock:
+            return [row[0] for row in self.db.execute('''SELECT title FROM pages
+                                                         ORDER BY mainpage, batch, position''')]
+
+    def users(self):
+        '''Return an ordered dictionary of the contributors and their number of edits.'''
+        with self.lock:
+            return OrderedDict(self.db.execute('SELECT name, edits FROM contributors '
+                                               'ORDER BY position'))
@@ -0,0 +1,183 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013–2015Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+'''A local stand-in for the Wikisource API, so the download stages can be tested and timed without
+a network. Responses are replayed from a folder of fixtures, one file per distinct query:
+
+    python mockserver.py fixtures --port 8000 --latency 0.2 --error-rate 0.05
+    python core.py --api http://localhost:8000/w/api.php
+
+To record the fixtures, run the server with --record, pointing it at the real API. Any query it
+doesn't have a fixture for is then passed along, and the response is saved:
+
+    python mockserver.py fixtures --record https://en.wikisource.org/w/api.php
+'''
+
+__all__ = ['FixtureServer']
+
+import argparse, codecs, gzip, hashlib, json, logging, os, random, threading
+from http import client, server
+from time import sleep
+from urllib import error, parse
+from transport import Transport
+
+# Content type of the fixtures of each format that were recorded without one
+content_types = {'json': 'application/json; charset=utf-8', 'txt': 'text/plain; charset=utf-8'}
+
+class FixtureHandler(server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # Keep connections alive, as the real API does
+
+    def do_GET(self):
+        mock = self.server
+        query = parse.urlsplit(self.path).query
+        if mock.latency:
+            sleep(mock.latency + random.uniform(0, mock.jitter))
+        if mock.error_rate and random.random() < mock.error_rate:
+            mock.count('errors')
+            self.respond(503, json.dumps({"error": {"code": "unavailable",
+                                                    "info": "Injected error"}}),
+                         {'Retry-After': str(mock.retry_after)})
+            return
+        try:
+            fixture = mock.replay(query)
+        except error.HTTPError as e:
+            # Pass the API's own failure along, so the client retries (or gives up) as it would
+            mock.count('failures')
+            headers = dict()
+            if e.headers and e.headers.get('Retry-After'):
+                headers['Retry-After'] = e.headers['Retry-After']
+            self.respond(e.code, json.dumps({"error": {"code": "upstream",
+                                                       "info": "The API returned HTTP {}"
+                                                       .format(e.code)}}), headers)
+            return
+        except (client.HTTPException, OSError) as e:
+            mock.count('failures')
+            self.respond(502, json.dumps({"error": {"code": "upstream",
+                                                    "info": "Unable to reach the API: " + repr(e)}}))
+            return
+        if fixture is None:
+            mock.count('misses')
+            self.respond(404, json.dumps({"error": {"code": "nofixture",
+                                                    "info": "No fixture for " + query}}))
+        else:
+            mock.count('hits')
+            body, content_type = fixture
+            self.respond(200, body, content_type=content_type)
+
+    def respond(self, status, body, headers=dict(), content_type=content_types['json']):
+        data = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            data = gzip.compress(data)
+            self.send_header('Content-Encoding', 'gzip')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        self.server.logger.debug(format % args)
+
+class FixtureServer(server.ThreadingHTTPServer):
+    '''Serves recorded API responses from a folder of fixtures. The fixture for a query is named by
+    the hash of its sorted parameters (apart from maxlag), so the order of the parameters in the URL
+    doesn't matter.'''
+    daemon_threads = True
+
+    def __init__(self, fixtures, port=8000, latency=0, jitter=0, error_rate=0, retry_after=1,
+                 record=None):
+        server.ThreadingHTTPServer.__init__(self, ('localhost', port), FixtureHandler)
+        self.logger = logging.getLogger("W2L")
+        self.fixtures = fixtures
+        self.latency = latency # Seconds to wait before answering each request
+        self.jitter = jitter # Up to this many seconds are randomly added to the latency
+        self.error_rate = error_rate # Fraction of requests answered with 503 Service Unavailable
+        self.retry_after = retry_after # Seconds sent in the Retry-After header of those errors
+        self.record = record # URL of the API to record missing fixtures from
+        self.transport = Transport() if record else None
+        self.counts = {'hits': 0, 'misses': 0, 'errors': 0, 'failures': 0}
+        self.lock = threading.Lock()
+        os.makedirs(fixtures, exist_ok=True)
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def fixture(self, query):
+        '''Return the filename of the fixture for the query.'''
+        params = [(name, value) for name, value in parse.parse_qsl(query, keep_blank_values=True)
+                  if name != 'maxlag']
+        fmt = dict(params).get('format', 'json')
+        key = hashlib.sha1(parse.urlencode(sorted(params)).encode('utf-8')).hexdigest()
+        return os.path.join(self.fixtures, key + '.' + fmt)
+
+    def replay(self, query):
+        '''Return the recorded response for the query and its content type, recording it first if
+        necessary. Returns None if there is no fixture for it. When recording, an unsuccessful
+        response from the API raises an HTTPError, and nothing is saved.'''
+        filename = self.fixture(query)
+        if os.path.exists(filename):
+            with codecs.open(filename, 'r', 'utf-8') as file:
+                body = file.read()
+            content_type = content_types.get(filename.rsplit('.', 1)[1], content_types['txt'])
+            if os.path.exists(filename + '.type'):
+                with codecs.open(filename + '.type', 'r', 'utf-8') as file:
+                    content_type = file.read().strip()
+            return body, content_type
+        if not self.record:
+            return None
+        body, headers = self.transport.response(self.record + '?' + query)
+        content_type = headers.get('Content-Type', content_types['txt'])
+        with codecs.open(filename, 'w', 'utf-8') as file:
+            file.write(body)
+        with codecs.open(filename + '.type', 'w', 'utf-8') as file:
+            file.write(content_type)
+        return body, content_type
+
+
+if __name__ == "__main__":
+    arguments = argparse.ArgumentParser(description="Replay recorded Wikisource API responses.")
+    arguments.add_argument('fixtures', help="Folder containing the recorded responses.")
+    arguments.add_argument('--port', type=int, default=8000)
+    arguments.add_argument('--latency', type=float, default=0,
+                           help="Seconds to wait before answering each request.")
+    arguments.add_argument('--jitter', type=float, default=0,
+                           help="Maximum number of seconds randomly added to the latency.")
+    arguments.add_argument('--error-rate', type=float, default=0,
+                           help="Fraction of requests to answer with 503 Service Unavailable.")
+    arguments.add_argument('--retry-after', type=int, default=1,
+                           help="Seconds to send in the Retry-After header of injected errors.")
+    arguments.add_argument('--record', metavar='API',
+                           help="Record missing fixtures from this API.")
+    args = arguments.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s: %(message)s")
+    mock = FixtureServer(args.fixtures, args.port, args.latency, args.jitter, args.error_rate,
+                         args.retry_after, args.record)
+    print("Serving {} at http://localhost:{}/w/api.php".format(args.fixtures, args.port))
+    try:
+        mock.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print("Requests served from fixtures: {hits}, missing: {misses}, injected errors: {errors}, "
+          "failed upstream: {failures}".format(**mock.counts))
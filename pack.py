@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013–2015Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+__all__ = ['Pack']
+
+import logging, mmap, os
+
+class Pack(object):
+    '''A single append-only file holding the text of every page, used in place of the many small
+    files in /text. The manifest records where each page is: the main page (volume) and API call
+    (batch) it belongs to, its page number, and the offset and length of its UTF-8 text in the
+    file. A batch that is downloaded again is appended to the end and its entries replaced; the old
+    text is left where it was. The file is memory-mapped for reading, so each batch is read by
+    slicing it rather than opening a file.'''
+
+    def __init__(self, filename, manifest):
+        self.logger = logging.getLogger("W2L")
+        self.filename = filename
+        self.manifest = manifest
+        self.index = None # (volume, batch) -> [(offset, length)...], loaded when first read
+        self.file = None
+        self.map = None
+
+    def append(self, volume, batch, pages):
+        '''Add the text of a batch of pages, given as a list of (page number, text), to the end of
+        the pack and record where it is.'''
+        if self.file is None:
+            self.close()
+            self.file = open(self.filename, 'ab')
+        offset = self.file.tell()
+        entries = list()
+        for number, text in pages:
+            data = text.encode('utf-8')
+            self.file.write(data)
+            entries.append((number, offset, len(data)))
+            offset += len(data)
+        self.file.flush()
+        self.manifest.save_packed(volume, batch, entries)
+        self.index = None
+
+    def batches(self, volume):
+        '''Return the numbers of the batches stored for a volume, in order.'''
+        self.load()
+        return sorted(batch for (vol, batch) in self.index.keys() if vol == volume)
+
+    def close(self):
+        '''Close the file and its memory map.'''
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+
+    def exists(self):
+        '''Return whether anything has been stored in the pack.'''
+        self.load()
+        return os.path.exists(self.filename) and bool(self.index)
+
+    def load(self):
+        '''Load the index from the manifest if it isn't loaded already.'''
+        if self.index is None:
+            self.index = self.manifest.packed()
+
+    def read(self, volume, batch):
+        '''Return the text of a batch of pages, in page order.'''
+        self.load()
+        if self.map is None:
+            if self.file is not None:
+                self.close()
+            with open(self.filename, 'rb') as file:
+                self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        return "".join(self.map[offset:offset+length].decode('utf-8')
+                       for offset, length in self.index[(volume, batch)])
+
+    def volumes(self):
+        '''Return the numbers of the volumes stored in the pack, in order.'''
+        self.load()
+        return sorted(set(vol for (vol, batch) in self.index.keys()))
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013–2015Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+__all__ = ['Prefilter']
+
+import re
+import lex
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:
+    import sre_parse, sre_constants
+
+ANY = None # Stands for "any character" in a set of first characters
+LARGEST_RANGE = 256 # Character ranges wider than this are treated as matching anything
+
+class Prefilter(object):
+    '''Lexes with a PLY lexer's rules, but only tries the rules that can match at each position.
+    PLY tries one master regex made of every rule in the state, in order, at each position. Here
+    each rule is compiled on its own, and for every state there is a table from each character to
+    the rules (in the same order) whose matches can begin with it. Rules that might begin with
+    anything, or match nothing at all, are tried at every position. The first rule that matches is
+    the one PLY would have chosen, so the tokens are the same; plain text just doesn't have to
+    wait for every template, tag and link rule to fail first.
+
+    Working out the tables takes longer than reading PLY's cached ones, so they are built once for
+    each set of rules (identified by the key, such as Tokenizer.rules_hash()) and shared by every
+    Prefilter made from a lexer with the same rules. PLY's rules are methods of the object the
+    lexer was built from, so the tables hold the plain functions, which are called with that
+    object.'''
+
+    layouts = dict() # Key -> tables, shared by every Prefilter built from the same rules
+
+    def __init__(self, lexer, key=None):
+        self.lexer = lexer
+        rules = {state: [entry for master, findex in masters for entry in findex if entry]
+                 for state, masters in lexer.lexstatere.items()}
+        self.owner = next(func.__self__ for entries in rules.values() for func, name in entries)
+        if key is not None and key in Prefilter.layouts:
+            self.tables = Prefilter.layouts[key]
+            return
+        # State -> (character -> [(regex, function, name)...], rules for the rest)
+        self.tables = {state: self.table(entries) for state, entries in rules.items()}
+        if key is not None:
+            Prefilter.layouts[key] = self.tables
+
+    def first(self, pattern):
+        '''Return the set of characters a match of the regex can begin with, or ANY if it could
+        begin with anything or could match the empty string.'''
+        flags = self.lexer.lexreflags
+        if flags & re.IGNORECASE:
+            return ANY
+        chars, empty = self.first_chars(sre_parse.parse(pattern, flags))
+        return ANY if empty else chars
+
+    def first_chars(self, items):
+        '''Return the characters the parsed regex can begin with (or ANY), and whether it can match
+        the empty string.'''
+        chars = set()
+        for op, argument in items:
+            empty = False
+            if op is sre_constants.LITERAL:
+                found = {chr(argument)}
+            elif op is sre_constants.IN:
+                found = self.in_chars(argument)
+            elif op is sre_constants.SUBPATTERN:
+                found, empty = self.first_chars(argument[-1])
+            elif op is sre_constants.BRANCH:
+                found = set()
+                for branch in argument[1]:
+                    branch_chars, branch_empty = self.first_chars(branch)
+                    if branch_chars is ANY:
+                        return ANY, True
+                    found |= branch_chars
+                    empty = empty or branch_empty
+            elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+                found, empty = self.first_chars(argument[2])
+                empty = empty or argument[0] == 0
+            elif op in (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+                # Anchors and lookarounds don't use up any text, so the next item begins the match
+                found, empty = set(), True
+            else:
+                return ANY, True
+            if found is ANY:
+                return ANY, True
+            chars |= found
+            if not empty:
+                return chars, False
+        return chars, True
+
+    def in_chars(self, items):
+        '''Return the characters a character class matches, or ANY.'''
+        chars = set()
+        for op, argument in items:
+            if op is sre_constants.LITERAL:
+                chars.add(chr(argument))
+            elif op is sre_constants.RANGE and argument[1] - argument[0] < LARGEST_RANGE:
+                chars.update(chr(code) for code in range(argument[0], argument[1] + 1))
+            else:
+                return ANY # Negated classes, categories such as \s, and very wide ranges
+        return chars
+
+    def table(self, rules):
+        '''Build the table for a state from its rules, given as PLY's (func, name) pairs in the
+        order it tries them.'''
+        flags = self.lexer.lexreflags
+        compiled = list()
+        chars = set()
+        for func, name in rules:
+            first = self.first(func.__doc__)
+            compiled.append((re.compile(func.__doc__, flags), func.__func__, name, first))
+            if first is not ANY:
+                chars |= first
+        table = dict()
+        for char in chars:
+            table[char] = [(regex, func, name) for regex, func, name, first in compiled
+                           if first is ANY or char in first]
+        rest = [(regex, func, name) for regex, func, name, first in compiled if first is ANY]
+        return table, rest
+
+    def token(self):
+        '''Return the next token, or None at the end of the input, as PLY's own lexer.token()
+        would. Rules may change the state and the position, so these are read from the lexer again
+        whenever a rule returns nothing.'''
+        lexer = self.lexer
+        owner = self.owner
+        data = lexer.lexdata
+        position = lexer.lexpos
+        length = lexer.lexlen
+        table, rest = self.tables[lexer.lexstate]
+        while position < length:
+            for regex, func, name in table.get(data[position], rest):
+                match = regex.match(data, position)
+                if match:
+                    break
+            else:
+                if lexer.lexerrorf:
+                    token = lex.LexToken()
+                    token.value = data[position:]
+                    token.lineno = lexer.lineno
+                    token.type = 'error'
+                    token.lexer = lexer
+                    token.lexpos = position
+                    lexer.lexpos = position
+                    new = lexer.lexerrorf(token)
+                    if lexer.lexpos == position:
+                        raise lex.LexError("Scanning error. Illegal character '{}'"
+                                           .format(data[position]), data[position:])
+                    position = lexer.lexpos
+                    table, rest = self.tables[lexer.lexstate]
+                    if new:
+                        return new
+                    continue
+                lexer.lexpos = position
+                raise lex.LexError("Illegal character '{}' at index {}"
+                                   .format(data[position], position), data[position:])
+            token = lex.LexToken()
+            token.value = match.group()
+            token.lineno = lexer.lineno
+            token.lexpos = position
+            token.type = name
+            token.lexer = lexer
+            lexer.lexmatch = match
+            lexer.lexpos = match.end()
+            new = func(owner, token)
+            if new:
+                return new
+            position = lexer.lexpos
+            table, rest = self.tables[lexer.lexstate]
+        lexer.lexpos = position + 1
+        return None
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013–2015Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+__all__ = ['Scheduler']
+
+import json, logging, random, re, threading
+from http import client
+from time import sleep, time
+from urllib import error, parse
+from exceptions import RequestFailed, RequestRejected
+
+class Scheduler(object):
+    '''Sits between the Document and the transport, and decides when each request is sent. Requests
+    to each host are spaced out to stay under a rate limit, and failed requests are retried with
+    exponential backoff and jitter. When the server asks us to slow down (with a Retry-After header
+    or a maxlag error), every thread waits before sending anything else to that host.'''
+
+    retry_statuses = (429, 500, 502, 503, 504) # HTTP statuses worth retrying
+    rejected_statuses = (400, 413, 414) # HTTP statuses caused by what the request asked for
+
+    def __init__(self, transport, rate=50, retries=6, backoff=1, max_backoff=60, maxlag=5):
+        self.logger = logging.getLogger("W2L")
+        self.transport = transport
+        self.interval = 1/rate if rate else 0 # Minimum number of seconds between requests to a host
+        self.retries = retries # Number of times to retry a request before giving up
+        self.backoff = backoff # Seconds to wait before the first retry; this doubles each time
+        self.max_backoff = max_backoff
+        self.maxlag = maxlag # Ask the API to refuse requests while its database lag is this high
+        self.next_time = dict() # Earliest time the next request may be sent to each host
+        self.lock = threading.Lock()
+
+    def get(self, url):
+        '''Perform a GET request and return the decoded body of the response, retrying it if
+        necessary. Raises RequestFailed if the request can't be completed, or RequestRejected if the
+        server refused it because of what it asked for.'''
+        host = parse.urlsplit(url).netloc
+        if self.maxlag is not None and 'maxlag=' not in url:
+            url += ('&' if '?' in url else '?') + 'maxlag=' + str(self.maxlag)
+        for attempt in range(self.retries + 1):
+            self.wait(host)
+            retry_after = None
+            try:
+                body, headers = self.transport.response(url)
+            except error.HTTPError as e:
+                if e.code in self.rejected_statuses:
+                    raise RequestRejected("{} returned HTTP {}".format(url, e.code)) from e
+                if e.code not in self.retry_statuses:
+                    raise RequestFailed("{} returned HTTP {}".format(url, e.code)) from e
+                retry_after = self.retry_after(e.headers.get('Retry-After'))
+                reason = "HTTP {}".format(e.code)
+            except (client.HTTPException, OSError) as e:
+                reason = repr(e)
+            else:
+                lag = self.lagged(body, headers)
+                if lag is None:
+                    return body
+                retry_after = lag
+                reason = "maxlag"
+            if attempt == self.retries:
+                break
+            # Full jitter: wait a random time up to the exponential backoff, but never less than
+            # the server asked for
+            delay = random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+            if retry_after is not None:
+                delay = max(delay, retry_after)
+                self.hold(host, delay)
+            self.logger.debug("Request failed ({}); retrying in {} seconds."
+                              .format(reason, round(delay, 2)))
+            sleep(delay)
+        raise RequestFailed("{} failed after {} retries ({})".format(url, self.retries, reason))
+
+    def hold(self, host, delay):
+        '''Stop any requests from being sent to the host for the next few seconds.'''
+        with self.lock:
+            self.next_time[host] = max(self.next_time.get(host, 0), time() + delay)
+
+    def lagged(self, body, headers=None):
+        '''If the API refused the request because of a maxlag error, return the number of seconds
+        to wait before trying again. Otherwise return None. MediaWiki refuses with HTTP 200, in
+        whatever format was asked for, and marks the response with a MediaWiki-API-Error header
+        (and X-Database-Lag); the body is only checked for servers that don't send the header.'''
+        if headers is not None and (headers.get('MediaWiki-API-Error') == 'maxlag' or
+                                    headers.get('X-Database-Lag') is not None):
+            lag = self.retry_after(headers.get('X-Database-Lag'))
+            if lag is None:
+                lag = self.retry_after(headers.get('Retry-After')) or 0
+            return max(lag, self.maxlag)
+        if 'maxlag' not in body[:300]:
+            return None
+        # format=txt prints the error as a PHP array: [code] => maxlag ... [lag] => 7
+        if re.search(r'\[code\] => maxlag\b', body[:300]):
+            lag = re.search(r'\[lag\] => ([\d.]+)', body[:500])
+            return max(float(lag.group(1)) if lag else 0, self.maxlag)
+        try:
+            lag = json.loads(body)["error"]
+        except (ValueError, KeyError, TypeError):
+            return None
+        if lag.get("code") != "maxlag":
+            return None
+        return max(float(lag.get("lag", 0)), self.maxlag)
+
+    def retry_after(self, value):
+        '''Return the number of seconds from a Retry-After header, or None.'''
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+
+    def wait(self, host):
+        '''Wait until the next request may be sent to the host, and reserve that slot.'''
+        with self.lock:
+            now = time()
+            start = max(now, self.next_time.get(host, 0))
+            self.next_time[host] = start + self.interval
+        if start > now:
+            sleep(start - now)
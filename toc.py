@@ -29,6 +29,7 @@ class TOC(object):
         self.logger = logging.getLogger("W2L")
         
         self.text = ''          # Raw wikitext
+        self.parts = []         # Pieces of the raw wikitext, joined when the TOC is complete
         self.lines = []
         self.levels = dict()
         self.props = ''
@@ -40,9 +41,10 @@ class TOC(object):
         "By: NWD Date: 2011\n\\vspace{2em}\n\\end{scriptsize}\n\\end{center}\n\\end{spacing}\n")
         
     def append(self, text):
-        self.text += text
+        self.parts.append(text)
         
     def begin(self):
+        self.text = ''.join(self.parts)
         ind = self.text.find("|")
         self.text = self.text[ind:]
         self.lines = self.text.replace('\n','').split("|-")
@@ -19,10 +19,101 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-__all__ = ['Tokenizer']
+__all__ = ['Token', 'Tokenizer', 'tokenize_files']
 
-import codecs, logging, re, os
-import lex
+import hashlib, importlib.util, logging, os, re, tempfile
+import lex, util
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from prefilter import Prefilter
+
+unset = object() # Marks a token whose value is the text it matched
+worker = None # The Tokenizer of a process in a pool, built when the process starts
+
+def start_worker():
+    '''Build the Tokenizer for a process in the pool. It reads the lexer tables once, then lexes
+    every file the process is given.'''
+    global worker
+    worker = Tokenizer()
+
+def tokenize(filename, data=None, state='INITIAL'):
+    '''Tokenize a single file in a process in the pool, starting in the given lexer state. Returns
+    its list of Tokens and the state the lexer ended in. The text is read from the file unless
+    it's given. This is kept outside of Tokenizer so it can be run in a pool of processes.'''
+    if data is None:
+        with util.open_file(filename) as f:
+            data = f.read()
+    worker.lexer.begin(state)
+    tokens = worker.analyze(data, filename)
+    return tokens, worker.lexer.lexstate
+
+def tokenize_files(files, processes):
+    '''Tokenize files in a pool of processes, yielding the list of Tokens for each file in the
+    order they were given, exactly as one Tokenizer would lex them one after another. Each file is
+    given as (filename, text), where the text is None if the process should read it from the file.
+    Every Token of a file shares its text, so each list is sent back with a single copy of the
+    text. Only a few files per process are lexed ahead of the one being yielded, so the lists
+    don't pile up while the caller is busy with them.
+    
+    A file carries on in the state the file before it ended in (a table of contents, for one,
+    continues onto the next page), which isn't known until that file has been lexed. Each file is
+    lexed ahead from the INITIAL state, and if the file before it turns out to have ended in any
+    other state, it is lexed again from that state before it is yielded.'''
+    with ProcessPoolExecutor(processes, initializer=start_worker) as executor:
+        state = 'INITIAL' # The state the last file yielded ended in
+        def finish(filename, data, future):
+            nonlocal state
+            tokens, end = future.result()
+            if state != 'INITIAL':
+                tokens, end = executor.submit(tokenize, filename, data, state).result()
+            state = end
+            return tokens
+        pending = deque()
+        for filename, data in files:
+            pending.append((filename, data, executor.submit(tokenize, filename, data)))
+            if len(pending) > 2 * processes:
+                yield finish(*pending.popleft())
+        while pending:
+            yield finish(*pending.popleft())
+
+class Token(object):
+    '''A token, kept as small as possible: the index of its type in Tokenizer.tokens, and the
+    position of the text it matched in the source. The text is only sliced out of the source when
+    the value is needed. If the rule worked out some other value (a group, or a tuple of groups),
+    that is kept instead. For compatibility token[0] is the type and token[1] is the value.'''
+    __slots__ = ('code', 'start', 'end', 'source', 'extra')
+    
+    def __init__(self, code, start, end, source, extra=unset):
+        self.code = code
+        self.start = start
+        self.end = end
+        self.source = source
+        self.extra = extra
+    
+    def __getitem__(self, index):
+        return (self.type, self.value)[index]
+    
+    def __len__(self):
+        return 2
+    
+    def __reduce__(self):
+        # Every token from a file shares its source, which pickle stores only once
+        if self.extra is unset:
+            return (Token, (self.code, self.start, self.end, self.source))
+        return (Token, (self.code, self.start, self.end, self.source, self.extra))
+    
+    def __repr__(self):
+        return "Token({}, {!r}, {}, {})".format(self.type, self.value, self.start, self.end)
+    
+    @property
+    def type(self):
+        return Tokenizer.tokens[self.code]
+    
+    @property
+    def value(self):
+        if self.extra is unset:
+            return self.source[self.start:self.end]
+        return self.extra
 
 class Tokenizer(object):
 #===================================================================================================
@@ -110,6 +201,7 @@ class Tokenizer(object):
               'ELLIPSES', # ... or ....
               'CHECKBOX_EMPTY',
               'CHECKBOX_CHECKED',
+              'TEXT', # Run of plain words, numbers, spaces and punctuation
               'PUNCT',
               'WORD',
               'NUMBER',
@@ -212,7 +304,8 @@ class Tokenizer(object):
         return token
     
     def t_contents_TOC_TEXT(self, token):
-        r'(?:.|\n)'
+        # Everything up to the next NEWPAGE or E_TOC, in one token
+        r'(?:[^<|]+|<(?!noinclude>\s?\|\}\s?</noinclude>)|\|(?!\})|(?<=<noinclude>)\|\})+'
         return token
     
     # Wikitable state
@@ -264,7 +357,8 @@ class Tokenizer(object):
         return token
     
     def t_tcell_CELL_CONTENTS(self, token):
-        r'(.+?)'
+        # Everything up to the next WT_COLSPAN, WT_STYLE, E_TCELL or WT_FILE, in one token
+        r'.(?:[^cs\s|\[]+|(?!colspan="\d"|style=".*?"|\s{0,2}\|\||\s?\n|\[{2}File\:.*?\]{2}).)*'
         return token
     
     # Tokens to be checked before HTML state
@@ -291,7 +385,12 @@ class Tokenizer(object):
         return token
     
     def t_RUNHEAD(self, token):
-        r'(\{{2}rh(?:(?:\{{2}.*?\}{2})|(?:[^\{])*?)+\}{2})'
+        r'\{{2}rh'
+        end = self.close_template(token)
+        if end == -1:
+            return self.fallback(token, 't_RUNHEAD')
+        token.lexer.lexpos = end + 2
+        token.value = token.lexer.lexdata[token.lexpos:end+2]
         return token
     
     def t_FORCED_WHITESPACE(self, token):
@@ -363,7 +462,18 @@ class Tokenizer(object):
         return token
     
     def t_centered_C_RIGHT(self, token):
-        r'[{]{2}(?:block\s)?right\|(?P<text>(?:(?:\{{2}.*?\}{2})|(?:[^\{])*?)+)\}{2,4}'
+        r'[{]{2}(?:block\s)?right\|'
+        end = self.close_template(token)
+        if end == -1:
+            return self.fallback(token, 't_centered_C_RIGHT')
+        # Up to two more closing braces are taken along with the template's own
+        data = token.lexer.lexdata
+        end += 2
+        for extra in range(2):
+            if data.startswith('}', end):
+                end += 1
+        token.lexer.lexpos = end
+        token.value = data[token.lexpos:end]
         return token
     
     def t_centered_right_A_UNDERLINED(self, token):
@@ -372,8 +482,13 @@ class Tokenizer(object):
         return token
     
     def t_LEFT(self, token):
-        r'[{]{2}left\|(?P<text>(?:(?:\{{2}.*?\}{2})|(?:[^\{])*?)+)\}{2}'
-        token.value = token.lexer.lexmatch.group('text')
+        r'[{]{2}left\|'
+        start = token.lexer.lexpos
+        end = self.close_template(token)
+        if end == -1:
+            return self.fallback(token, 't_LEFT')
+        token.lexer.lexpos = end + 2
+        token.value = token.lexer.lexdata[start:end]
         return token
     
     def t_INITIAL_RIGHT(self, token):
@@ -416,7 +531,12 @@ class Tokenizer(object):
         return token
     
     def t_SIZE(self, token):
-        r'[{]{2}(?:(?P<x>[x]{1,4})\-)?(?P<ls>larger|smaller)\|(?P<text>(?:(?:\{{2}.*?\}{2})|(?:[^\{])*?)+)[}]{2}'
+        r'[{]{2}(?:(?P<x>[x]{1,4})\-)?(?P<ls>larger|smaller)\|'
+        start = token.lexer.lexpos
+        end = self.close_template(token)
+        if end == -1:
+            return self.fallback(token, 't_SIZE')
+        token.lexer.lexpos = end + 2
         x = token.lexer.lexmatch.group('x')
         ls = token.lexer.lexmatch.group('ls')
         if ls == 'smaller':
@@ -437,7 +557,7 @@ class Tokenizer(object):
                 token.value = 'Huge',
             else:
                 token.value = 'large',
-        text = token.lexer.lexmatch.group('text'),
+        text = token.lexer.lexdata[start:end],
         token.value = token.value + text
         return token
         
@@ -477,11 +597,27 @@ class Tokenizer(object):
         return token
     
     def t_HI(self, token):
-        r'\{{2}hi\|\dem\|(?P<text>(?:(?:\{{2}.*?\}{2})|(?:[^\{])*?)+)\}{2}'
-        token.value = token.lexer.lexmatch.group('text')
+        r'\{{2}hi\|\dem\|'
+        start = token.lexer.lexpos
+        end = self.close_template(token)
+        if end == -1:
+            return self.fallback(token, 't_HI')
+        token.lexer.lexpos = end + 2
+        token.value = token.lexer.lexdata[start:end]
         return token
     
     # VERY basic matches that have to be checked last.
+    def t_TEXT(self, token):
+        # Plain prose, which would otherwise be a WORD, NUMBER, WHITESPACE or PUNCT token at a time.
+        # The run stops before anything another rule would match: newlines (which the parser
+        # treats specially), punctuation LaTeX treats specially, ellipses, and style=" (FORMAT, in
+        # the wikitable state). Spaces are only included between two other parts of the run, so
+        # the whitespace around newlines is still lexed as it was.
+        r"""(?!style=")(?:[a-zA-Zéâ]+|[0-9]+)(?:(?!style=")[a-zA-Zéâ]+|[0-9]+|[!()\-;+=,?/"@*:]|\.(?!\.\.)|[ \t]+(?=(?!style=")[a-zA-Zéâ0-9!()\-;+=,?/"@*:]|\.(?!\.\.)))*"""
+        # The value is escaped as the parser would escape each of the tokens
+        token.value = self.spaces.sub(' ', token.value).replace("é", "\\'{e}")
+        return token
+    
     def t_ELLIPSES(self, token):
         r'[.]{3,4}'
         return token
@@ -520,21 +656,145 @@ class Tokenizer(object):
 #===================================================================================================
 # MISCELLANEOUS FUNCTIONS
 #===================================================================================================
-    def __init__(self):
-        '''Initiate logging, open a file to store tokens, build the lexer.'''
+    spaces = re.compile(r'[ \t]+')
+    lextab_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lextab')
+    
+    def __init__(self, trace=None, prefilter=True):
+        '''Initiate logging, build the lexer. Pass a TokenTrace to record the tokens. Unless
+        prefilter is False, tokens are lexed by a Prefilter, which only tries the rules that can
+        begin with the character at each position, rather than by PLY's master regexes.'''
         self.logger = logging.getLogger("W2L")
-        self.lexer = lex.lex(module=self, reflags=re.DOTALL)
-    
-    def analyze(self, data):
-        '''Read through the text file and tokenize.'''
-        self.lexer.input(data)
-        self.token_list = list()
-        with codecs.open(os.curdir + '/tokenout.txt', 'w+', 'utf-8') as tokenfile:
-            while True:
-                token = self.lexer.token()
-                if not token:
-                    break      # No more input
-                l_token = [token.type, token.value]
-                self.token_list.append(l_token)
-                tokenfile.write(str(token) + '\n')
-        return self.token_list
\ No newline at end of file
+        self.scanner = None # Finds the ends of templates in the text being lexed
+        self.fallbacks = dict() # The rules to try, in order, when a template isn't closed
+        self.rules_key = self.rules_hash()
+        self.lexer = self.build()
+        # Has the token() to call. The Prefilter's tables are shared by every Tokenizer
+        self.engine = Prefilter(self.lexer, self.rules_key) if prefilter else self.lexer
+        self.trace = trace
+    
+    codes = dict() # Maps the name of each token type to its code; filled in below the class
+    
+    def analyze(self, data, name=None):
+        '''Read through the text file and tokenize, returning a list of every token.'''
+        self.token_list = list(self.iter_tokens(data, name))
+        return self.token_list
+    
+    def build(self):
+        '''Build the lexer. Validating the rules and assembling them into master regexes is slow,
+        so the first time a set of rules is built the tables are saved to /lextab, named by a hash
+        of the rules. Later builds (in this or any other process) read the tables from there; once
+        any rule changes, its hash no longer matches and the tables are built again.'''
+        name = 'lextab_' + self.rules_key
+        filename = os.path.join(self.lextab_dir, name + '.py')
+        if os.path.exists(filename):
+            try:
+                spec = importlib.util.spec_from_file_location(name, filename)
+                lextab = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(lextab)
+                return lex.lex(module=self, reflags=re.DOTALL, optimize=1, lextab=lextab)
+            except Exception:
+                self.logger.warning("Unable to read lexer tables from {}; rebuilding them."
+                                    .format(filename))
+        lexer = lex.lex(module=self, reflags=re.DOTALL)
+        # Write to a temporary folder and move the file into place, so other processes never
+        # read a half-written table
+        try:
+            os.makedirs(self.lextab_dir, exist_ok=True)
+            temp_dir = tempfile.mkdtemp(dir=self.lextab_dir)
+            try:
+                lexer.writetab(name, temp_dir)
+                os.replace(os.path.join(temp_dir, name + '.py'), filename)
+            finally:
+                for file in os.listdir(temp_dir):
+                    os.remove(os.path.join(temp_dir, file))
+                os.rmdir(temp_dir)
+            for file in os.listdir(self.lextab_dir):
+                if file.startswith('lextab_') and file != name + '.py':
+                    os.remove(os.path.join(self.lextab_dir, file))
+        except OSError:
+            self.logger.warning("Unable to save lexer tables to " + self.lextab_dir)
+        return lexer
+    
+    def close_template(self, token):
+        '''Return the position of the "}}" that closes the template whose opening a rule has just
+        matched, or -1 if it isn't closed. The template's contents begin where the lexer is now.'''
+        lexer = token.lexer
+        if self.scanner is None or self.scanner.text is not lexer.lexdata:
+            self.scanner = util.TemplateScanner(lexer.lexdata)
+        return self.scanner.close(lexer.lexpos)
+    
+    def fallback(self, token, rule):
+        '''Lex the text at the token's position as if the given rule had not matched it, by trying
+        each of the rules after it (in the current state) in the order PLY would. This is used by
+        rules that only match the opening of a template, when the template turns out not to be
+        closed. Returns whatever that rule returns.'''
+        lexer = token.lexer
+        key = (lexer.lexstate, rule)
+        if key not in self.fallbacks:
+            rules = list()
+            for lexre, findex in lexer.lexstatere[lexer.lexstate]:
+                for entry in findex:
+                    if entry and entry[0]:
+                        rules.append(entry)
+            names = [func.__name__ for func, name in rules]
+            self.fallbacks[key] = [(re.compile(func.__doc__, lexer.lexreflags), func, name)
+                                   for func, name in rules[names.index(rule)+1:]]
+        data = lexer.lexdata
+        position = token.lexpos
+        for regex, func, name in self.fallbacks[key]:
+            match = regex.match(data, position)
+            if match:
+                token.type = name
+                token.value = match.group()
+                lexer.lexmatch = match
+                lexer.lexpos = match.end()
+                return func(token)
+        token.type = 'error'
+        token.value = data[position:]
+        lexer.lexpos = position
+        return self.t_ANY_error(token)
+    
+    def iter_tokens(self, data, name=None):
+        '''Tokenize the text, yielding each Token as soon as it is lexed, so the parser can start
+        writing before the whole file has been read. The name of the file is only used to label the
+        trace. The lexer is shared, so each generator must be finished before the next is started;
+        the text is lexed from the state the last text ended in.'''
+        lexer = self.lexer
+        lexer.input(data)
+        engine = self.engine
+        codes = self.codes
+        trace = self.trace
+        if trace:
+            trace.begin(name)
+        while True:
+            token = engine.token()
+            if not token:
+                break      # No more input
+            if trace:
+                trace.token(token)
+            start = token.lexpos
+            end = lexer.lexpos
+            value = token.value
+            # Only keep the value if the rule changed it from the text that was matched
+            if type(value) is str and len(value) == end - start and data.startswith(value, start):
+                yield Token(codes[token.type], start, end, data)
+            else:
+                yield Token(codes[token.type], start, end, data, value)
+    
+    def rules_hash(self):
+        '''Return a hash of everything the lexer is built from: the token types, the states, and
+        the name and regex of every rule, in the order PLY tries them.'''
+        rules = list()
+        for attribute in dir(self):
+            if attribute.startswith('t_'):
+                rule = getattr(self, attribute)
+                if callable(rule):
+                    rules.append((rule.__code__.co_firstlineno, attribute, rule.__doc__))
+                else:
+                    rules.append((0, attribute, rule))
+        rules.sort(key=lambda rule: (rule[0], rule[1]) if rule[0] else (0, -len(rule[2]), rule[1]))
+        text = repr((getattr(lex, '__version__', ''), re.DOTALL, self.tokens, self.states,
+                     [rule[1:] for rule in rules]))
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()[:16]
+
+Tokenizer.codes = {name: code for code, name in enumerate(Tokenizer.tokens)}
@@ -19,9 +19,11 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-import logging, re, wikitable, util
+import logging, wikitable, util
+from attribution import ContributorIndex
 from reparse import Reparser
 from toc import TOC
+from tokenizer import Tokenizer
 
 class Parser(object):
     def __init__(self, progress):
@@ -30,34 +32,38 @@ class Parser(object):
         self.reparser = Reparser()
         self.indented = False
         self.progress = progress
+        # The method that handles each type of token, indexed by the token's code
+        self.handlers = [getattr(self, name.lower(), None) for name in Tokenizer.tokens]
     
     def begin(self, outputfile):
         self.output = outputfile
         
     def dispatch(self, t_list):
+        '''Write the LaTeX for each token in turn. The tokens can be any iterable of Tokens, such as
+        a list from Tokenizer.analyze or a generator from Tokenizer.iter_tokens.'''
+        handlers = self.handlers
         for token in t_list:
-            self.value = token[1]
+            self.value = token.value
             if self.value:
-                command = 'self.{0}()'.format(token[0].lower())
                 try:
-                    exec(command)
+                    handlers[token.code]()
                 except:
-                    self.logger.exception("Unable to run command " + command);
+                    self.logger.exception("Unable to run command self.{0}()"
+                                          .format(token.type.lower()));
                     break;
                 else:
                     self.write(self.value)
                     
-    def end_matter(self, contributors, outputfile):
+    def end_matter(self, contributors, outputfile, anonymous=False):
+        '''Write the license and the list of contributors. Any contributors who are IP addresses
+        are credited together as anonymous users, as are any other anonymous edits.'''
         #TODO: Will need to add image attribution, when I get to including images.
         self.output = outputfile
         self.logger.debug("Appending license information.")
         
-        for contributor in contributors:
-            if re.match(r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}', contributor):
-                contributors.remove(contributor)
-                anonymous = True
-        if anonymous:
-            contributors.append("anonymous users")
+        index = ContributorIndex()
+        index.add(contributors, 1 if anonymous else 0)
+        contributors = index.credits()
         
         begin = ("\n\\newpage\n\\rule{\\textwidth}{1px}\nContent available online at " + 
                  "http://en.wikisource.org/wiki/Pentagon\_Papers.\n")
@@ -164,39 +170,39 @@ class Parser(object):
     
     # WIKITABLE FUNCTIONS
     def wikitable(self):
-        self.table = wikitable.Table()
+        self.current_table = wikitable.Table()
         if self.value[1]:
-            self.table.format['alignment'] = 'center'
+            self.current_table.format['alignment'] = 'center'
         self.value = ''
     
     def e_wikitable(self):
-        self.value = self.table.end()
-        del self.table
+        self.value = self.current_table.end()
+        del self.current_table
         
     def tcell(self):
-        self.cell = wikitable.Cell(self.table)
+        self.cell = wikitable.Cell(self.current_table)
         self.value = ''
         
     def e_tcell(self):
         self.value = self.cell.end() # Get the final text of the cell
-        self.table.append_cell(self.value) # Add the cell to the table
+        self.current_table.append_cell(self.value) # Add the cell to the table
         self.cell.reset() # Reset cell values for next time
         self.value = ''
         
     def format(self):
         # TODO: Add cellpadding/cellspacing?
         if self.value[0]:                               # Table width
-            self.table.set_width(self.value[0])
+            self.current_table.set_width(self.value[0])
         if self.value[1]:                               # Text alignment
-            self.table.set_alignment(self.value[1])
+            self.current_table.set_alignment(self.value[1])
         if self.value[2]:                               # Border
-            self.table.format['border'] = True
-            self.table.t['hline'] = '\\hline\n'
+            self.current_table.format['border'] = True
+            self.current_table.t['hline'] = '\\hline\n'
         self.value = ''
 
     def wt_colspan(self):
         self.cell.c_format['colspan'] = self.value
-        self.table.format['multicol'] = True
+        self.current_table.format['multicol'] = True
         self.value = ''
         
     def wt_style(self):
@@ -208,7 +214,7 @@ class Parser(object):
             self.row_center = True
         else:
             self.row_center = False
-        self.table.append_row()
+        self.current_table.append_row()
         self.value = ''
     
     def wt_file(self):
@@ -456,6 +462,10 @@ class Parser(object):
         elif self.value == "✓":
             self.value = "{\\checked}"
     
+    def text(self):
+        '''Write a run of plain text to file. The tokenizer has already escaped it.'''
+        pass
+    
     def word(self):
         # TODO: Fix large spaces after abbreviations (i.e., e.g., etc.)
         '''Write word to file, using compose codes for any accented characters.'''
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013–2015Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+__all__ = ['TokenTrace']
+
+import codecs, fnmatch
+
+class TokenTrace(object):
+    '''Records the tokens the lexer produces, for debugging the tokenizer. Give one to the Tokenizer
+    to turn tracing on; without one nothing is recorded. The trace covers every file tokenized
+    while it is open, and can be limited to some token types, to files matching some patterns, or
+    to one token in every so many.'''
+
+    def __init__(self, filename='tokenout.txt', types=None, files=None, every=1):
+        self.filename = filename
+        self.types = set(types) if types else None # Token types to record, or None for all of them
+        self.files = list(files) if files else None # Patterns of file names to record, or None
+        self.every = max(1, every) # Record one in this many of the tokens that pass the filters
+        self.file = None
+        self.active = True # Whether the current file is being recorded
+        self.count = 0
+
+    def begin(self, name):
+        '''Start recording the tokens of a new file.'''
+        self.active = self.files is None or (name is not None and
+                                             any(fnmatch.fnmatch(name, pattern)
+                                                 for pattern in self.files))
+        self.count = 0
+        if self.active:
+            self.write("# " + (name or "(unnamed)"))
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def token(self, token):
+        '''Record a token, if it passes the filters.'''
+        if not self.active or (self.types is not None and token.type not in self.types):
+            return
+        if self.count % self.every == 0:
+            self.write(str(token))
+        self.count += 1
+
+    def write(self, line):
+        if self.file is None:
+            self.file = codecs.open(self.filename, 'w', 'utf-8')
+        self.file.write(line + '\n')
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2013–2015Molly White
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+__all__ = ['Transport']
+
+import gzip, logging, threading, zlib
+from http import client
+from urllib import error, parse
+
+class Transport(object):
+    '''Shared HTTP transport for all of the API requests. Each thread keeps one persistent
+    connection per host, so consecutive requests skip the TCP/TLS handshake, and responses are
+    requested gzip-compressed.'''
+
+    def __init__(self, timeout=30):
+        self.logger = logging.getLogger("W2L")
+        self.timeout = timeout # Seconds to wait when connecting or reading a response
+        self.max_redirects = 5
+        self.headers = {'Accept-Encoding': 'gzip, deflate',
+                        'Connection': 'keep-alive',
+                        'User-Agent': 'Wikisource-to-LaTeX (https://github.com/molly/Wikisource-to-LaTeX)'}
+        self.local = threading.local() # Holds the connections belonging to each thread
+
+    def connection(self, scheme, host):
+        '''Return this thread's open connection to the host, creating it if necessary.'''
+        if not hasattr(self.local, 'connections'):
+            self.local.connections = dict()
+        if (scheme, host) not in self.local.connections:
+            if scheme == 'https':
+                conn = client.HTTPSConnection(host, timeout=self.timeout)
+            else:
+                conn = client.HTTPConnection(host, timeout=self.timeout)
+            self.local.connections[(scheme, host)] = conn
+        return self.local.connections[(scheme, host)]
+
+    def close(self, scheme, host):
+        '''Close and forget this thread's connection to the host.'''
+        conn = self.local.connections.pop((scheme, host), None)
+        if conn:
+            conn.close()
+
+    def get(self, url):
+        '''Perform a GET request and return the decoded body of the response. Redirects are
+        followed, and any other unsuccessful response raises an HTTPError, as urlopen would.'''
+        return self.response(url)[0]
+
+    def request(self, url):
+        '''Send the request over a kept-alive connection. If the server has closed the connection
+        since it was last used, reconnect and try once more.'''
+        parts = parse.urlsplit(url)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        for attempt in range(2):
+            conn = self.connection(parts.scheme, parts.netloc)
+            try:
+                conn.request('GET', path, headers=self.headers)
+                response = conn.getresponse()
+                body = response.read()
+            except (client.HTTPException, ConnectionError):
+                self.close(parts.scheme, parts.netloc)
+                if attempt:
+                    raise
+                self.logger.debug("Connection to {} was closed; reconnecting.".format(parts.netloc))
+            except OSError:
+                # Timeouts and other socket errors leave the connection in an unknown state
+                self.close(parts.scheme, parts.netloc)
+                raise
+            else:
+                if response.will_close:
+                    self.close(parts.scheme, parts.netloc)
+                return response.status, response.reason, response.headers, body
+
+    def response(self, url):
+        '''Perform a GET request as get does, returning both the decoded body and the headers of
+        the response.'''
+        for redirect in range(self.max_redirects + 1):
+            status, reason, headers, body = self.request(url)
+            if status in (301, 302, 303, 307, 308) and headers.get('Location'):
+                url = parse.urljoin(url, headers.get('Location'))
+                continue
+            if status != 200:
+                raise error.HTTPError(url, status, reason, headers, None)
+            encoding = headers.get('Content-Encoding', '')
+            if encoding == 'gzip':
+                body = gzip.decompress(body)
+            elif encoding == 'deflate':
+                body = zlib.decompress(body)
+            return body.decode(headers.get_content_charset() or 'utf-8'), headers
+        raise error.HTTPError(url, status, "Too many redirects", headers, None)
@@ -19,6 +19,11 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
+import codecs, gzip, lzma, os, re
+
+# Compressed formats /raw and /text can be stored in, by file extension
+compressors = {'gz': gzip, 'xz': lzma}
+
 def findall(string, substring, start_ind=0, end_ind=None):
     indexes = []
     if not end_ind:
@@ -32,6 +37,14 @@ def findall(string, substring, start_ind=0, end_ind=None):
             break
     return indexes
 
+def open_file(filename, mode='r'):
+    '''Open a UTF-8 text file for reading or writing, compressing or decompressing it as it is
+    read or written if its name ends in .gz or .xz.'''
+    extension = os.path.splitext(filename)[1][1:]
+    if extension in compressors:
+        return compressors[extension].open(filename, mode + 't', encoding='utf-8')
+    return codecs.open(filename, mode, 'utf-8')
+
 class ProgressChecker(object):
     '''
     0: Without text
@@ -54,4 +67,98 @@ class ProgressChecker(object):
     
     def page(self, level):
         index = int(level)
-        self.status[index] += 1
\ No newline at end of file
+        self.status[index] += 1
+
+class TemplateScanner(object):
+    '''Finds where templates such as {{rh|...}} or {{left|...}} end, giving the same answers as
+    the pattern the tokenizer used to match their contents,
+    
+        (?:(?:\{{2}.*?\}{2})|(?:[^\{])*?)+\}{2}
+    
+    but in time proportional to the length of the text, where that pattern backtracks
+    exponentially if a template is never closed. That pattern reads the contents from left to
+    right: the template ends at the first "}}", a nested "{{" is skipped up to a "}}" after it (the
+    nearest one first, then each later one in turn if the rest of the contents can't be matched),
+    and a "{" on its own can't be matched at all. The result of reading on from each nested
+    template's possible ends is remembered, so each position is only considered once per text.'''
+    
+    stop = re.compile(r'\{|\}\}') # Characters that aren't simply part of the contents
+    
+    def __init__(self, text):
+        self.text = text
+        self.last = text.rfind('}}') # No template can be closed after this position
+        self.ends = dict() # Where the template ends if a nested template is skipped up to each "}}"
+        self.nested = dict() # Where the template ends after the nested template starting at each "{{"
+    
+    def close(self, start):
+        '''Return the position of the "}}" that closes the template whose contents begin at start,
+        or -1 if it isn't closed.'''
+        if start > self.last:
+            return -1
+        kind, position = self.read(start)
+        if kind == 'open':
+            if position not in self.nested:
+                self.nested[position] = self.skip(position + 2)
+            return self.nested[position]
+        return position
+    
+    def read(self, start):
+        '''Read the contents from start up to the next brace that matters. Returns ('close',
+        position) at a "}}", ('open', position) at a "{{", or ('fail', -1) at a lone "{" or the end
+        of the text.'''
+        match = self.stop.search(self.text, start)
+        if not match or start > self.last:
+            return 'fail', -1
+        position = match.start()
+        if match.group() == '}}':
+            return 'close', position
+        if self.text.startswith('{{', position):
+            return 'open', position
+        return 'fail', -1
+    
+    def skip(self, start):
+        '''Return where the template ends if a nested template, whose contents begin at start, is
+        skipped. Each "}}" after start is tried in turn as the end of the nested template, and the
+        first one that lets the rest of the template be read is used. This is worked out without
+        recursion, as templates may be nested or chained many times over.'''
+        text = self.text
+        stack = list() # Nested templates waiting on the result of reading on from a "}}"
+        task = start
+        while True:
+            # Find the first "}}" from task, and try to read on from it
+            end = text.find('}}', task)
+            if end == -1:
+                result = -1
+            elif end in self.ends:
+                result = self.ends[end]
+            else:
+                kind, position = self.read(end + 2)
+                if kind == 'close':
+                    result = position
+                    self.ends[end] = result
+                elif kind == 'open' and position not in self.nested:
+                    stack.append(('nested', position, end))
+                    task = position + 2
+                    continue
+                elif kind == 'open' and self.nested[position] != -1:
+                    result = self.nested[position]
+                    self.ends[end] = result
+                else:
+                    stack.append(('next', end))
+                    task = end + 1
+                    continue
+            # Pass the result back to the templates waiting on it
+            while stack:
+                frame = stack.pop()
+                if frame[0] == 'nested':
+                    self.nested[frame[1]] = result
+                    if result == -1:
+                        # Try the next "}}" as the end of the template before it
+                        stack.append(('next', frame[2]))
+                        task = frame[2] + 1
+                        break
+                    self.ends[frame[2]] = result
+                else:
+                    self.ends[frame[1]] = result
+            else:
+                return result